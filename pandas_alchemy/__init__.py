@@ -1,4 +1,7 @@
 from .db import init_db, close_db
+from .cache import enable_cache, disable_cache, invalidate_cache, cache_stats
+from .reflection import configure_reflection, invalidate_reflection
+from .parallel import configure_parallel
 from .alchemy import DataFrame, Series
 
 
@@ -18,4 +21,8 @@ def use_repr_workaround():
     Series.__repr__ = to_pandas_repr
 
 
-__all__ = ["init_db", "close_db", "DataFrame", "Series"]
+__all__ = [
+    "init_db", "close_db", "enable_cache", "disable_cache", "invalidate_cache",
+    "cache_stats", "configure_reflection", "invalidate_reflection",
+    "configure_parallel", "DataFrame", "Series"
+]
@@ -0,0 +1,136 @@
+import decimal
+import numpy as np
+import sqlalchemy as sa
+from . import dialect
+
+REDUCTIONS = {}
+NUMERIC = (int, float, bool, decimal.Decimal)
+
+
+def reduction(name, numeric=True):
+    """
+    Register f as the reduction name. f(value, skipna, **kwargs) returns
+    (aggregate expression, finish), where finish converts the fetched
+    result to its Python value.
+
+    When numeric is true, numeric_only=None keeps numeric columns only.
+    """
+    def decorator(f):
+        REDUCTIONS[name] = (f, numeric)
+        return f
+
+    return decorator
+
+
+def python_type(value):
+    """ Return the python_type of value, or None if it is unknown. """
+    try:
+        return value.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def is_numeric(value):
+    # Columns of unknown type are given the benefit of the doubt
+    ptype = python_type(value)
+    return ptype is None or issubclass(ptype, NUMERIC)
+
+
+def valid(value):
+    """ Return value with NaN replaced by NULL, as aggregates skip NULL. """
+    if python_type(value) not in (float, None):
+        return value
+    is_nan = dialect.CURRENT["is_nan"](value)
+    if isinstance(is_nan, sa.sql.expression.False_):
+        return value
+    return sa.type_coerce(sa.case((is_nan, sa.null()), else_=value),
+                          value.type)
+
+
+def number(value):
+    if python_type(value) is bool:
+        return sa.cast(value, sa.Integer)
+    return value
+
+
+def skipping(result, value, skipna):
+    """ Return result, or NULL if value has NA and skipna is false. """
+    if skipna:
+        return result
+    has_na = sa.func.count() > sa.func.count(value)
+    return sa.case((has_na, sa.null()), else_=result)
+
+
+def finisher(value_type):
+    """ Return the function converting fetched values to value_type. """
+    def finish(value):
+        if value is None:
+            return np.nan
+        if value_type in (int, float):
+            return value_type(value)
+        if isinstance(value, decimal.Decimal):
+            return float(value)
+        return value
+
+    return finish
+
+
+@reduction("sum")
+def sum_(value, skipna=True, min_count=0):
+    value = number(valid(value))
+    result = sa.func.coalesce(sa.func.sum(value), 0)
+    if min_count > 0:
+        enough = sa.func.count(value) >= min_count
+        result = sa.case((enough, result), else_=sa.null())
+    ptype = python_type(value)
+    return skipping(result, value, skipna), finisher(ptype)
+
+
+@reduction("mean")
+def mean(value, skipna=True):
+    value = valid(value)
+    result = sa.func.avg(sa.cast(number(value), sa.FLOAT))
+    return skipping(result, value, skipna), finisher(float)
+
+
+@reduction("min", numeric=False)
+def min_(value, skipna=True):
+    value = valid(value)
+    result = sa.func.min(value)
+    return skipping(result, value, skipna), finisher(python_type(value))
+
+
+@reduction("max", numeric=False)
+def max_(value, skipna=True):
+    value = valid(value)
+    result = sa.func.max(value)
+    return skipping(result, value, skipna), finisher(python_type(value))
+
+
+@reduction("count", numeric=False)
+def count(value):
+    return sa.func.count(valid(value)), finisher(int)
+
+
+@reduction("var")
+def var(value, skipna=True, ddof=1):
+    value = valid(value)
+    result = dialect.CURRENT["var"](number(value), ddof)
+    is_inf = dialect.CURRENT["is_inf"](value)
+    if not isinstance(is_inf, sa.sql.expression.False_):
+        # Like pandas, any infinite value makes the variance NaN
+        has_inf = sa.func.sum(sa.case((is_inf, 1), else_=0)) > 0
+        result = sa.case((has_inf, sa.null()), else_=result)
+    return skipping(result, value, skipna), finisher(float)
+
+
+@reduction("std")
+def std(value, skipna=True, ddof=1):
+    result, finish = var(value, skipna, ddof)
+    return dialect.CURRENT["sqrt"](result), finish
+
+
+__all__ = [
+    "REDUCTIONS", "NUMERIC", "reduction", "python_type", "is_numeric", "valid",
+    "number", "skipping", "finisher"
+]
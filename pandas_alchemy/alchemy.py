@@ -2,24 +2,16 @@ import operator
 import collections
 import pandas as pd
 import sqlalchemy as sa
-from . import db
+from . import reflection
 from . import utils
+from . import temp
+from . import dialect
 from . import coercion
+from . import aggregate
 from . import base
 from . import generic
 from . import ops_mixin
-
-
-def row_to_query(index, data):
-    if not pd.api.types.is_list_like(index):
-        index = [index]
-    else:
-        index = list(index)
-    if not pd.api.types.is_list_like(data):
-        data = [data]
-    else:
-        data = list(data)
-    return sa.select([sa.literal(v) for v in index + data])
+from . import groupby as groupby_
 
 
 def dataframe_op(op, name=None, before=None, after=None):
@@ -96,6 +88,48 @@ def series_cmp(op, name=None, before=None, after=None):
     return cmp_func
 
 
+def clip_op(bound):
+    """
+    Return the operator applying bound, greatest or least, to a value and
+    its threshold. NULL values stay NULL, as NaN does in pandas, while
+    NULL thresholds are ignored.
+    """
+    def op(value, threshold):
+        bounded = bound(value, threshold)
+        if isinstance(bounded.type, sa.types.NullType):
+            # greatest() and least() are unknown to sqlalchemy
+            bounded = sa.type_coerce(bounded, value.type)
+        return sa.case((value.isnot(None), bounded))
+
+    return op
+
+
+def filter_rows(frame, key):
+    """
+    If key is a boolean mask, return the rows of frame it selects.
+    Otherwise, return None.
+
+    A boolean Series, of pandas or not, selects rows by index. When it
+    shares its source with frame, it becomes a WHERE clause on that
+    source. A list-like of booleans selects rows by position.
+    """
+    if isinstance(key, pd.Series) and pd.api.types.is_bool_dtype(key):
+        key = Series.from_pandas(key)
+    if isinstance(key, Series):
+        if aggregate.python_type(key._the_col) is not bool:
+            return None
+        return frame._filter(key)
+    if not pd.api.types.is_list_like(key) or isinstance(key, pd.Series):
+        return None
+    if pd.api.types.infer_dtype(key, skipna=False) != "boolean":
+        return None
+    key = list(key)
+    if len(key) != len(frame):
+        raise ValueError(f"Item wrong length {len(key)} "
+                         f"instead of {len(frame)}.")
+    return frame._filter(Series.from_list(key), positional=True)
+
+
 class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
     ndim = 2
     _AXIS_MAPPER = utils.merge(base.BaseFrame._AXIS_MAPPER, {
@@ -110,19 +144,50 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
         except KeyError:
             return self.__getattribute__(name)
 
+    def __getitem__(self, key):
+        rows = filter_rows(self, key)
+        if rows is not None:
+            return rows
+        if pd.api.types.is_list_like(key):
+            return self._take_cols(key)
+        return self._seq_at(self._columns.get_loc(key))
+
+    def _loc_rows(self, key):
+        rows = filter_rows(self, key)
+        if rows is None:
+            raise NotImplementedError
+        return rows
+
+    @utils.copied
+    def _take_cols(self, labels):
+        """ Keep the columns labels, in that order. """
+        labels = list(labels)
+        locs = self._columns.get_indexer(labels)
+        missing = [label for label, i in zip(labels, locs) if i == -1]
+        if missing:
+            raise KeyError(f"{missing} not in index")
+        cols = [self._col_at(i) for i in locs]
+        self._project(self._idx() + cols, inplace=True)
+        self._columns = self._columns[locs]
+
     def _seq_at(self, i, name=None):
         """ Return the Series corresponding to column i. """
         if name is None:
             name = self._columns[i]
-        query = sa.select(self._idx() + [self._col_at(i)])
-        return Series(self._index, pd.Index([name]), query.cte(), name)
+        # Start from the rows of self and project the column out of its
+        # source, so that the other columns are not computed at all
+        seq = Series(self._index, pd.Index([name]), self._cte, name)
+        seq._temps = self._temps
+        seq._lineage = self._lineage
+        seq._project(self._idx() + [self._col_at(i)], inplace=True)
+        return seq
 
     @property
     def columns(self):
         return self._columns
 
     def iterrows(self):
-        for row in self._fetch():
+        for row in self._fetch(stream=True):
             idx = row[:len(self._index)] if self._is_mindex else row[0]
             data = pd.Series(row[len(self._index):], index=self._columns)
             yield idx, data
@@ -136,7 +201,7 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
         if index:
             fields.insert(0, "Index")
         named_tuple = collections.namedtuple(name, fields, rename=True)
-        for row in self._fetch():
+        for row in self._fetch(stream=True):
             if index:
                 idx = row[:len(self._index)] if self._is_mindex else row[0]
                 yield named_tuple(idx, *row[len(self._index):])
@@ -153,13 +218,11 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
                 # says axis 0 in the corresponding exception.
                 raise IndexError(f"index {col} is out of bounds for "
                                  f"axis 0 with size {len(self._columns)}")
-            row_count = len(self)
-            index = utils.wrap(index, row_count)
-            if index < 0 or index >= row_count:
+            row = self._row_at([self._col_at(col)], index)
+            if row is None:
                 raise IndexError(f"index {index} is out of bounds for "
-                                 f"axis 0 with size {row_count}")
-            col = sa.select([self._col_at(col)])
-            return col.limit(1).offset(index).scalar()
+                                 f"axis 0 with size {len(self)}")
+            return row[0]
         raise NotImplementedError
 
     @utils.copied
@@ -172,17 +235,18 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
             reverse=False):
         axis = 1 if axis is None else self._get_axis(axis)
 
-        def app_op(lhs, rhs):
+        def app_ops(lhss, rhss):
             if reverse:
-                lhs, rhs = rhs, lhs
-            result = coercion.app_op_coerced(op, lhs, rhs)
+                lhss, rhss = rhss, lhss
+            results = coercion.app_ops_coerced(op, lhss, rhss)
             if fill_value is None:
-                return result
-            return sa.func.coalesce(result, fill_value)
+                return results
+            return [sa.func.coalesce(r, fill_value) for r in results]
 
         if pd.api.types.is_scalar(other):
-            cols = [app_op(c, other) for c in self._cols()]
-            self._cte = sa.select(self._idx() + cols).cte()
+            cols = self._cols()
+            cols = app_ops(cols, [other] * len(cols))
+            self._project(self._idx() + cols, inplace=True)
             return
         if isinstance(other, (Series, pd.Series)):
             other = Series.from_pandas(other, optional=True)
@@ -190,22 +254,23 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
                 columns, idxers = self._join_cols(other.index)
                 other = list(other)
                 other.append(sa.sql.expression.Null())  # other[-1] => NULL
-                cols = [app_op(self._col_at(i), other[j]) for i, j in idxers]
-                self._cte = sa.select(self._idx() + cols).cte()
+                cols = app_ops([self._col_at(i) for i, _ in idxers],
+                               [other[j] for _, j in idxers])
+                self._project(self._idx() + cols, inplace=True)
                 self._columns = columns
                 return
-            cols = [app_op(c, other._the_col) for c in self._cols()]
+            cols = self._cols()
+            cols = app_ops(cols, [other._the_col] * len(cols))
             self._join_idx(other, cols, level=level, inplace=True)
             return
         if isinstance(other, (DataFrame, pd.DataFrame)):
-            other = DataFrame.from_pandas(other)
-            if self._cte == other._cte:
+            other = DataFrame.from_pandas(other, optional=True)
+            if self._cte == other._cte and level is not None:
                 # Ensure different names for self join
                 self._cte = self._cte.alias()
             columns, idxers = self._join_cols(other._columns)
-            cols = [
-                app_op(self._col_at(i), other._col_at(j)) for i, j in idxers
-            ]
+            cols = app_ops([self._col_at(i) for i, _ in idxers],
+                           [other._col_at(j) for _, j in idxers])
             self._join_idx(other, cols, level=level, inplace=True)
             self._columns = columns
             return
@@ -216,10 +281,8 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
                 if len(other) != num_cols:
                     raise ValueError(f"Unable to coerce to Series, length "
                                      f"must be {num_cols}: given {len(other)}")
-                cols = [
-                    app_op(self._col_at(i), other[i]) for i in range(num_cols)
-                ]
-                self._cte = sa.select(self._idx() + cols).cte()
+                cols = app_ops(self._cols(), other)
+                self._project(self._idx() + cols, inplace=True)
                 return
             num_rows = len(self)
             if len(other) != num_rows:
@@ -228,9 +291,12 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
             other = Series.from_list(other)
             other_rowid = other._idx_at(0)
             this, other, joined = self._paste_join(other, other_rowid)
-            cols = [app_op(c, other._the_col) for c in this._cols()]
+            cols = this._cols()
+            cols = app_ops(cols, [other._the_col] * len(cols))
             query = sa.select(this._idx() + cols).select_from(joined)
-            self._cte = query.cte()
+            self._cte = base.lower(query)
+            self._temps = this._temps
+            self._set_row_count(num_rows)
             return
         raise TypeError(f"Cannot broadcast np.ndarray with "
                         f"operand of type {type(other)}")
@@ -258,8 +324,24 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
                 raise ValueError("Must specify axis=0 or 1")
             if not pd.api.types.is_scalar(upper):
                 raise ValueError("Must specify axis=0 or 1")
-        self._op(sa.func.greatest, lower, axis=axis, inplace=True)
-        self._op(sa.func.least, upper, axis=axis, inplace=True)
+        greatest = clip_op(dialect.CURRENT["greatest"])
+        least = clip_op(dialect.CURRENT["least"])
+        self._op(greatest, lower, axis=axis, inplace=True)
+        self._op(least, upper, axis=axis, inplace=True)
+
+    def groupby(self,
+                by=None,
+                axis=0,
+                level=None,
+                as_index=True,
+                sort=True,
+                group_keys=True,
+                squeeze=False,
+                observed=False,
+                dropna=True):
+        if self._get_axis(axis) != 0 or not as_index:
+            raise NotImplementedError
+        return groupby_.DataFrameGroupBy(self, by, level, sort, dropna)
 
     @utils.copied
     def applymap(self, func, na_action=None):
@@ -284,19 +366,12 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
         columns = map(lambda c: str(c) + suffix, self._columns)
         self._columns = pd.Index(columns)
 
-    def to_pandas(self):
-        index = []
-        columns = []
-        for row in self._fetch():
-            columns.append(row[len(self._index):])
-            idx = row[:len(self._index)] if self._is_mindex else row[0]
-            index.append(idx)
-        if self._is_mindex:
-            index = pd.MultiIndex.from_tuples(index, names=self._index)
-        else:
-            index = pd.Index(index, name=self._index[0])
-        df = pd.DataFrame.from_records(columns, columns=self._columns)
-        return df.set_index(index)
+    def _to_pandas(self, arrays):
+        index = self._make_index(arrays[:len(self._index)])
+        data = enumerate(arrays[len(self._index):])
+        df = pd.DataFrame(dict(data), index=index)
+        df.columns = self._columns
+        return df
 
     @staticmethod
     def from_pandas(df, optional=False):
@@ -304,11 +379,14 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
             if optional:
                 return df
             raise TypeError("Must be a pandas DataFrame")
-        query = sa.union_all(
-            *[row_to_query(index, data) for index, data in df.iterrows()])
-        query.bind = db.metadata().bind
+        tbl, handle = temp.load(df)
+        base.set_row_key(tbl, [tbl.columns.pos])
         index = pd.Index(df.index.names)
-        return DataFrame(index, df.columns, query.cte())
+        result = DataFrame(index, df.columns, base.lower(temp.select(tbl)))
+        result._temps = frozenset((handle, ))
+        result._set_lineage(tbl, list(tbl.columns)[1:])
+        result._set_row_count(len(df))
+        return result
 
     @staticmethod
     def from_table(table, schema=None, columns=None, index=None):
@@ -323,14 +401,15 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
         Otherwise, if index is not None, it is taken as the name
         of the column to become the DataFrame's index.
         """
-        tbl = sa.Table(table,
-                       db.metadata(),
-                       schema=schema,
-                       extend_existing=True,
-                       autoload=True)
+        tbl = reflection.table(table, schema)
         cols = [c.name for c in tbl.columns]
+        key = dialect.CURRENT["row_key"](tbl)
+        if key:
+            position = base.set_row_key(tbl, key)[1]
+        else:
+            position = sa.func.row_number().over()
         if index is None:
-            idx = [sa.func.row_number().over() - 1]
+            idx = [position - 1]
             index = pd.Index((None, ))
         else:
             if not pd.api.types.is_list_like(index):
@@ -347,7 +426,11 @@ class DataFrame(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
                 cols.index(c)
         cols = [tbl.columns[i].label(None) for i in columns]
         query = sa.select(idx + cols)
-        return DataFrame(index, columns, query.cte())
+        if key:
+            query = query.order_by(*base.ROW_KEYS[tbl][0])
+        df = DataFrame(index, columns, base.lower(query))
+        df._set_lineage(tbl, idx + cols)
+        return df
 
 
 class Series(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
@@ -358,28 +441,48 @@ class Series(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
         self.name = name
 
     def __iter__(self):
-        for row in self._fetch():
+        for row in self._fetch(stream=True):
             yield row[-1]
 
+    def __getitem__(self, key):
+        rows = filter_rows(self, key)
+        if rows is None:
+            raise NotImplementedError
+        return rows
+
+    _loc_rows = __getitem__
+
+    def groupby(self,
+                by=None,
+                axis=0,
+                level=None,
+                as_index=True,
+                sort=True,
+                group_keys=True,
+                squeeze=False,
+                observed=False,
+                dropna=True):
+        if self._get_axis(axis) != 0 or not as_index:
+            raise NotImplementedError
+        return groupby_.SeriesGroupBy(self, by, level, sort, dropna)
+
     @property
     def _the_col(self):
         """ Return THE column of the Series. """
         return self._col_at(0)
 
     def iteritems(self):
-        for row in self._fetch():
+        for row in self._fetch(stream=True):
             idx = row[:-1] if self._is_mindex else row[0]
             yield idx, row[-1]
 
     def _get_value(self, label, takeable=False):
         if takeable:
-            row_count = len(self)
-            label = utils.wrap(label, row_count)
-            if label < 0 or label > row_count:
+            row = self._row_at([self._the_col], label)
+            if row is None:
                 raise IndexError(f"index {label} is out of bounds "
-                                 f"for axis 0 with size {row_count}")
-            col = sa.select([self._the_col])
-            return col.limit(1).offset(label).scalar()
+                                 f"for axis 0 with size {len(self)}")
+            return row[0]
         raise NotImplementedError
 
     @utils.copied
@@ -406,11 +509,11 @@ class Series(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
 
         if pd.api.types.is_scalar(other):
             col = app_op(self._the_col, other)
-            self._cte = sa.select(self._idx() + [col]).cte()
+            self._project(self._idx() + [col], inplace=True)
             return
         if isinstance(other, (Series, pd.Series)):
             other = Series.from_pandas(other, optional=True)
-            if self._cte == other._cte:
+            if self._cte == other._cte and level is not None:
                 # Ensure different names for self join
                 self._cte = self._cte.alias()
             col = app_op(self._the_col, other._the_col)
@@ -426,7 +529,7 @@ class Series(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
             other = list(other)
             if lax and len(other) == 1:
                 col = app_op(self._the_col, other[0])
-                self._cte = sa.select(self._idx() + [col]).cte()
+                self._project(self._idx() + [col], inplace=True)
                 return
             row_count = len(self)
             if len(other) != row_count:
@@ -441,7 +544,9 @@ class Series(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
             this, other, joined = self._paste_join(other, other_rowid)
             col = app_op(this._the_col, other._the_col)
             query = sa.select(this._idx() + [col]).select_from(joined)
-            self._cte = query.cte()
+            self._cte = base.lower(query)
+            self._temps = this._temps
+            self._set_row_count(row_count)
             return
         raise TypeError(f"Cannot broadcast np.ndarray with "
                         f"operand of type {type(other)}")
@@ -464,31 +569,24 @@ class Series(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
 
     @utils.copied
     def clip(self, lower=None, upper=None, axis=None, *args, **kwargs):
-        self._op(sa.func.greatest, lower, axis=axis, inplace=True, lax=False)
-        self._op(sa.func.least, upper, axis=axis, inplace=True, lax=False)
+        greatest = clip_op(dialect.CURRENT["greatest"])
+        least = clip_op(dialect.CURRENT["least"])
+        self._op(greatest, lower, axis=axis, inplace=True, lax=False)
+        self._op(least, upper, axis=axis, inplace=True, lax=False)
 
     @utils.copied
     def add_prefix(self, prefix):
-        idx = map(lambda i: sa.func.concat(prefix, i), self._idx())
-        self._cte = sa.select(idx + self._cols()).cte()
+        idx = [sa.func.concat(prefix, i) for i in self._idx()]
+        self._project(idx + self._cols(), inplace=True)
 
     @utils.copied
     def add_suffix(self, suffix):
-        idx = map(lambda i: sa.func.concat(i, suffix), self._idx())
-        self._cte = sa.select(idx + self._cols()).cte()
+        idx = [sa.func.concat(i, suffix) for i in self._idx()]
+        self._project(idx + self._cols(), inplace=True)
 
-    def to_pandas(self):
-        index = []
-        value = []
-        for row in self._fetch():
-            idx = row[:-1] if self._is_mindex else row[0]
-            index.append(idx)
-            value.append(row[-1])
-        if self._is_mindex:
-            index = pd.MultiIndex.from_tuples(index, names=self._index)
-        else:
-            index = pd.Index(index, name=self._index[0])
-        return pd.Series(value, index=index, name=self.name)
+    def _to_pandas(self, arrays):
+        index = self._make_index(arrays[:-1])
+        return pd.Series(arrays[-1], index=index, name=self.name)
 
     @staticmethod
     def from_pandas(seq, name=None, optional=False):
@@ -498,23 +596,19 @@ class Series(base.BaseFrame, generic.GenericMixin, ops_mixin.OpsMixin):
             raise TypeError("Must be a pandas Series")
         if name is None:
             name = seq.name
-        query = sa.union_all(
-            *[row_to_query(index, data) for index, data in seq.iteritems()])
-        query.bind = db.metadata().bind
+        tbl, handle = temp.load(seq)
+        base.set_row_key(tbl, [tbl.columns.pos])
         index = pd.Index(seq.index.names)
         columns = pd.Index((name, ))
-        return Series(index, columns, query.cte(), name)
+        result = Series(index, columns, base.lower(temp.select(tbl)), name)
+        result._temps = frozenset((handle, ))
+        result._set_lineage(tbl, list(tbl.columns)[1:])
+        result._set_row_count(len(seq))
+        return result
 
     @staticmethod
     def from_list(values, name=None):
-        query = sa.union_all(*[
-            sa.select([sa.literal(i), sa.literal(v)])
-            for i, v in enumerate(values)
-        ])
-        query.bind = db.metadata().bind
-        index = pd.Index([None])
-        columns = pd.Index([None])
-        return Series(index, columns, query.cte(), name)
+        return Series.from_pandas(pd.Series(values), name=name)
 
 
 __all__ = ["DataFrame", "Series"]
@@ -0,0 +1,116 @@
+import numpy as np
+import sqlalchemy as sa
+from pandas.compat._optional import import_optional_dependency
+from . import dialect
+from . import columnar
+
+# Checked in order: Boolean and Float must not be taken for Integer
+# and Numeric by a dialect subclassing them.
+ARROW_TYPES = [(sa.Boolean, lambda pa: pa.bool_()),
+               (sa.Float, lambda pa: pa.float64()),
+               (sa.Integer, lambda pa: pa.int64()),
+               (sa.String, lambda pa: pa.string()),
+               (sa.DateTime, lambda pa: pa.timestamp("us")),
+               (sa.Date, lambda pa: pa.date32()),
+               (sa.Time, lambda pa: pa.time64("us")),
+               (sa.LargeBinary, lambda pa: pa.binary())]
+
+
+def pyarrow():
+    """ Import pyarrow, an optional dependency. """
+    return import_optional_dependency("pyarrow",
+                                      extra="pyarrow is required for Arrow "
+                                      "output.")
+
+
+def arrow_type(column):
+    """
+    Return the Arrow type of the values of column, or None if it is
+    to be inferred from the values themselves.
+    """
+    if getattr(column.type, "timezone", False):
+        return None
+    for sa_type, make in ARROW_TYPES:
+        if isinstance(column.type, sa_type):
+            return make(pyarrow())
+    return None
+
+
+def to_arrow(values, type_):
+    """
+    Convert values, a NumPy or Arrow array, to an Arrow array of type_,
+    or of the type inferred from values if type_ is None. NaN becomes
+    null, as it is missing data to pandas.
+    """
+    pa = pyarrow()
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        if type_ is None or values.type == type_:
+            return values
+        return values.cast(type_)
+    mask = None
+    if np.ma.isMaskedArray(values):
+        mask = np.ma.getmaskarray(values)
+        values = np.ma.getdata(values)
+    try:
+        return pa.array(values, type=type_, mask=mask, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # SQLite returns booleans as integers, for one
+        inferred = pa.array(values, mask=mask, from_pandas=True)
+        return inferred.cast(type_)
+
+
+def record_batch(arrays, types, schema, order):
+    """
+    Assemble arrays, one for each column of a frame, into a RecordBatch
+    of schema, whose fields are the columns in order. The types of
+    types that are None are inferred, and replaced by what they are
+    inferred to, so that the next batches have the same schema.
+    """
+    pa = pyarrow()
+    arrays = [to_arrow(a, t) for a, t in zip(arrays, types)]
+    for i, a in enumerate(arrays):
+        if types[i] is None and not pa.types.is_null(a.type):
+            types[i] = a.type
+    fields = [
+        schema.field(j).with_type(arrays[i].type) for j, i in enumerate(order)
+    ]
+    return pa.RecordBatch.from_arrays([arrays[i] for i in order],
+                                      schema=pa.schema(fields,
+                                                       schema.metadata))
+
+
+def iter_record_batches(result,
+                        columns,
+                        schema,
+                        order,
+                        batch_size=columnar.BATCH_SIZE):
+    """
+    Fetch result in batches of at most batch_size rows, and yield each
+    batch as a RecordBatch, see record_batch(). The batches come from
+    the dialect as they are when it fetches Arrow on its own.
+    """
+    types = [arrow_type(c) for c in columns]
+    batches = None
+    cursor = columnar.raw_cursor(result, columns)
+    if cursor is not None:
+        batches = dialect.CURRENT["fetch_record_batches"](cursor, batch_size)
+    if batches is None:
+        source = columnar.iter_columns(result, columns, batch_size)
+    else:
+        source = (batch.columns for batch in batches)
+    try:
+        empty = True
+        for arrays in source:
+            empty = False
+            yield record_batch(arrays, types, schema, order)
+        if empty:
+            arrays = [np.empty(0, columnar.numpy_type(c)) for c in columns]
+            yield record_batch(arrays, types, schema, order)
+    finally:
+        result.close()
+
+
+__all__ = [
+    "ARROW_TYPES", "pyarrow", "arrow_type", "to_arrow", "record_batch",
+    "iter_record_batches"
+]
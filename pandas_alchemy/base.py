@@ -1,10 +1,184 @@
+import weakref
+import pandas as pd
 import sqlalchemy as sa
 from . import utils
+from . import cache
 from . import dialect
+from . import columnar
+from . import parallel
+
+# cte => [row count or None], shared by ctes holding the same rows
+ROW_COUNTS = weakref.WeakKeyDictionary()
+# source => (key, position). key lists the columns ordering the rows of
+# source, and position is the row_number() numbering them in that order,
+# which default indexes over source are made of.
+ROW_KEYS = weakref.WeakKeyDictionary()
+# source => (parent, mapping) for the sources made by extend(). mapping
+# maps (the ids of) the columns and the row key of parent to those of
+# source, which has one row per row of parent.
+EXTENSIONS = weakref.WeakKeyDictionary()
+
+
+def set_row_key(source, key):
+    """
+    Register key as the columns ordering the rows of source, unless
+    source already has a row key. Return (key, position), see ROW_KEYS.
+    """
+    if source not in ROW_KEYS:
+        ROW_KEYS[source] = (key, sa.func.row_number().over(order_by=key))
+    return ROW_KEYS[source]
+
+
+def uses(exprs, element):
+    """ Whether element appears in any of exprs. """
+    for expr in exprs:
+        for e in sa.sql.visitors.iterate(expr):
+            if e is element:
+                return True
+    return False
+
+
+def substitute(exprs, mapping):
+    """ Replace every column c in exprs by mapping[id(c)], if any. """
+    if not mapping:
+        return list(exprs)
+
+    def substituted(expr):
+        def replace(element):
+            replacement = mapping.get(id(element))
+            if replacement is None or element is expr:
+                return replacement
+            # Operators were grouped against the column, not against
+            # what replaces it: a * 2 with a => b + 1 is (b + 1) * 2
+            return replacement.self_group()
+
+        return sa.sql.visitors.replacement_traverse(expr, {}, replace)
+
+    return [substituted(e) for e in exprs]
+
+
+def expression_size(expr, limit=None):
+    """ Count the nodes of expr, stopping once limit is exceeded. """
+    size = 0
+    for _ in sa.sql.visitors.iterate(expr):
+        size += 1
+        if limit is not None and size > limit:
+            break
+    return size
+
+
+def has_window(exprs):
+    """ Whether any of exprs contains a window function. """
+    for expr in exprs:
+        for element in sa.sql.visitors.iterate(expr):
+            if isinstance(element, sa.sql.expression.Over):
+                return True
+    return False
+
+
+def windowed(source, exprs, partition_by=()):
+    """
+    Compute the window functions in exprs, aggregates over source, in a
+    SELECT over source of their own, as they cannot be nested in
+    aggregates. They are partitioned by partition_by, expressions over
+    source the rows are grouped by. Return (that SELECT, exprs rewritten
+    over it), or (source, exprs) if exprs have no window function.
+    """
+    windows, columns = {}, {}
+    for expr in list(exprs) + list(partition_by):
+        for element in sa.sql.visitors.iterate(expr):
+            if isinstance(element, sa.sql.expression.Over):
+                windows[id(element)] = element
+            elif isinstance(element, sa.sql.expression.ColumnClause):
+                # Not the * of count(*)
+                if not element.is_literal:
+                    columns[id(element)] = element
+    if not windows:
+        return source, list(exprs)
+    computed = [
+        w.element.over(partition_by=list(partition_by) or None)
+        for w in windows.values()
+    ]
+    labeled = [e.label(None) for e in list(columns.values()) + computed]
+    inner = lower(sa.select(labeled).select_from(source))
+    mapping = dict(zip(list(columns) + list(windows), inner.columns))
+    return inner, substitute(exprs, mapping)
+
+
+def fits(exprs):
+    """
+    Whether each of exprs is small enough to be inlined once more. See
+    dialect max_expression_size.
+    """
+    limit = dialect.CURRENT["max_expression_size"]()
+    return all(expression_size(e, limit) <= limit for e in exprs)
+
+
+def lower(query):
+    """ Make query the FROM clause element of a frame, see dialect lower. """
+    if isinstance(query, sa.sql.Select):
+        query = query.with_only_columns(named(query.selected_columns))
+    return dialect.CURRENT["lower"](query)
+
+
+def named(exprs):
+    """
+    Label the unnamed expressions among exprs. sqlalchemy tells apart
+    the unnamed columns of a CTE or subquery by position only in cache
+    keys, so selecting one or another of them would reuse the statement
+    compiled for the first.
+    """
+    names = (sa.sql.expression.ColumnClause, sa.sql.expression.Label)
+    return [e if isinstance(e, names) else e.label(None) for e in exprs]
+
+
+def extend(source, exprs):
+    """
+    Compute exprs, expressions over source, in a SELECT which also
+    passes on every column and the row key of source, so that frames
+    over source can be rewritten over it, see lift(). Return (the SELECT
+    made a FROM clause element, its columns holding exprs).
+    """
+    key = ROW_KEYS.get(source)
+    passed = list(source.columns)
+    if key is not None:
+        passed += [k for k in key[0] if not any(k is c for c in passed)]
+    query = sa.select([e.label(None) for e in passed + list(exprs)])
+    extended = dialect.CURRENT["materialize"](query.select_from(source))
+    columns = list(extended.columns)
+    mapping = dict(zip(map(id, passed), columns))
+    EXTENSIONS[extended] = (source, mapping)
+    if key is not None:
+        ROW_KEYS[extended] = (substitute(key[0],
+                                         mapping), substitute([key[1]],
+                                                              mapping)[0])
+    return extended, columns[len(passed):]
+
+
+def lift(exprs, source, target):
+    """
+    Rewrite exprs, expressions over source, as expressions over target,
+    source itself or an extension of it, see extend(). Return None if
+    target is neither.
+    """
+    mappings = []
+    while target is not source:
+        if target not in EXTENSIONS:
+            return None
+        target, mapping = EXTENSIONS[target]
+        mappings.append(mapping)
+    for mapping in reversed(mappings):
+        exprs = substitute(exprs, mapping)
+    return list(exprs)
 
 
 class BaseFrame:
     _AXIS_MAPPER = {0: 0, "index": 0, "rows": 0}
+    # Handles of the temporary tables the frame is backed by
+    _temps = frozenset()
+    # (cte, source, exprs): selecting exprs from source yields the rows
+    # of cte, one row per row of source. Stale once _cte is replaced.
+    _lineage = None
 
     def __init__(self, index, columns, cte):
         self._index = index
@@ -23,6 +197,10 @@ class BaseFrame:
         return list(self._cte.columns)[len(self._index):total]
 
     def _lvl_at(self, i):
+        return self._idx_at(self._lvl_loc(i))
+
+    def _lvl_loc(self, i):
+        """ Return the position of level i, a level name or number. """
         if i in self._index:
             i = self._index.get_loc(i)
         else:
@@ -34,7 +212,7 @@ class BaseFrame:
         if i >= len(self._index):
             raise IndexError(f"Too many levels: Index has only "
                              f"{len(self._index)} levels, not {i}")
-        return self._idx_at(i)
+        return i
 
     def _idx_at(self, i):
         return self._cte.columns[i]
@@ -52,14 +230,343 @@ class BaseFrame:
                              f"type {self.__class__.__name__}")
         return axis_num
 
-    def _fetch(self):
-        return sa.select(self._cte).execute()
+    def _source(self):
+        """
+        Return (source, exprs) such that selecting exprs from source
+        yields the rows of the frame, one row per row of source.
+        """
+        if self._lineage is not None and self._lineage[0] is self._cte:
+            return self._lineage[1:]
+        return self._cte, list(self._cte.columns)
+
+    def _keyed(self):
+        """
+        If the rows of the frame are those of a source with a row key,
+        return (source, exprs, key, position), see ROW_KEYS. Otherwise,
+        return None.
+        """
+        source, exprs = self._source()
+        if source is self._cte or source not in ROW_KEYS:
+            return None
+        return (source, exprs) + ROW_KEYS[source]
+
+    def _page(self, n, offset=0, last=False):
+        """
+        Select the first n rows of a frame with a row key, or the last n
+        rows if last is true, in key order. offset is the position of the
+        first selected row. Return (source, exprs, key, position) for the
+        frame of those rows, as _keyed() does.
+
+        Only the selected rows are read, seeking them through the key,
+        and the default index is computed over them alone.
+        """
+        key = self._keyed()[2]
+        order = [k.desc() for k in key] if last else key
+        return self._rebase(lambda rows: rows.order_by(*order).limit(n),
+                            offset)
+
+    def _rebase(self, restrict, offset=0):
+        """
+        Select the rows of a frame with a row key that restrict() keeps,
+        given the SELECT of the columns and the key of the source. offset
+        is the position of the first kept row. Return (source, exprs, key,
+        position) for the frame of those rows, as _keyed() does.
+        """
+        source, exprs, key, position = self._keyed()
+        inner = sa.select(list(source.columns) + [k.label(None) for k in key])
+        sub = restrict(inner).subquery()
+        columns = list(sub.columns)
+        sub_key = columns[len(source.columns):]
+        mapping = dict(zip(map(id, source.columns), columns))
+        mapping.update(zip(map(id, key), sub_key))
+        row_number = sa.func.row_number().over(order_by=sub_key)
+        mapping[id(position)] = row_number + offset
+        return sub, substitute(exprs, mapping), sub_key, row_number
+
+    def _partitions(self, n, strategy):
+        """
+        Split the query of the frame into at most n queries, each for a
+        part of its rows in key order, following strategy, see
+        parallel.configure_parallel(). Return None if the frame cannot
+        be split this way.
+        """
+        keyed = self._keyed()
+        if keyed is None:
+            return None
+        source, exprs, key, position = keyed
+        if strategy == "ntile":
+            part = sa.func.ntile(n).over(order_by=key)
+            labeled = [e.label(None) for e in exprs + [part] + key]
+            sub = sa.select(labeled).select_from(source).subquery()
+            columns = list(sub.columns)
+            sub_key = columns[len(exprs) + 1:]
+            return [
+                sa.select(columns[:len(exprs)]).where(
+                    columns[len(exprs)] == i + 1).order_by(*sub_key)
+                for i in range(n)
+            ]
+        if has_window(substitute(exprs, {id(position): sa.null()})):
+            # Windows would only see the rows of their range
+            return None
+        count = len(self)
+        n = min(n, count)
+        if n < 2:
+            return None
+        offsets = [count * i // n for i in range(n)]
+        bounds = []
+        for offset in offsets[1:]:
+            query = sa.select(key).select_from(source).order_by(*key)
+            bounds.append(
+                sa.tuple_(
+                    *cache.execute(query.limit(1).offset(offset)).first()))
+        row = sa.tuple_(*key)
+        queries = []
+        for i, offset in enumerate(offsets):
+            conds = []
+            if i > 0:
+                conds.append(row >= bounds[i - 1])
+            if i < n - 1:
+                conds.append(row < bounds[i])
+            source_, exprs_, key_, _ = self._rebase(
+                lambda rows: rows.where(*conds), offset)
+            query = sa.select(exprs_).select_from(source_).order_by(*key_)
+            queries.append(query)
+        return queries
+
+    def _set_page(self, page):
+        """ Replace the frame by a page, see _page(). """
+        source, exprs, key, position = page
+        self._cte = lower(sa.select(exprs).select_from(source).order_by(*key))
+        self._set_lineage(source, exprs)
+        ROW_KEYS[source] = (key, position)
+
+    def _row_at(self, exprs, i):
+        """
+        Select exprs, columns of the frame, at position i, counted from
+        the end if negative. Return the row, or None if i is out of
+        bounds. Frames with a row key are read in a single query.
+        """
+        keyed = self._keyed()
+        if keyed is not None:
+            # Seek through the key, backwards for negative positions
+            source, lineage, key, _ = keyed
+            mapping = dict(zip(map(id, self._cte.columns), lineage))
+            query = sa.select(substitute(exprs, mapping)).select_from(source)
+            if i < 0:
+                query = query.order_by(*[k.desc() for k in key])
+            else:
+                query = query.order_by(*key)
+            offset = i if i >= 0 else -i - 1
+        else:
+            query = sa.select(exprs).select_from(self._cte)
+            if i < 0:
+                # Without a key there is no reverse order to seek by,
+                # but the row count is kept for later lookups
+                i += len(self)
+                if i < 0:
+                    return None
+            offset = i
+        query = query.limit(1).offset(offset)
+        return cache.execute(query).first()
+
+    def _count_cell(self):
+        """ Return the cell caching the number of rows of the frame. """
+        return ROW_COUNTS.setdefault(self._cte, [None])
+
+    def _set_row_count(self, count):
+        self._count_cell()[0] = count
+
+    def _set_lineage(self, source, exprs):
+        self._lineage = (self._cte, source, exprs)
+
+    def _inline(self, exprs, *others):
+        """
+        Rewrite exprs, expressions over the cte columns of self and of
+        others sharing its source, as expressions over that source, or
+        over the extension of it the frames are read from, see extend().
+        Return (source, rewritten exprs).
+        """
+        frames = (self, ) + others
+        source = self._source()[0]
+        for frame in others:
+            frame_source = frame._source()[0]
+            if lift([], source, frame_source) is not None:
+                source = frame_source
+        mapping = {}
+        for frame in frames:
+            frame_source, lineage = frame._source()
+            lineage = lift(lineage, frame_source, source)
+            mapping.update(zip(map(id, frame._cte.columns), lineage))
+        return source, substitute(exprs, mapping)
+
+    def _aligned(self, other):
+        """
+        Whether self and other share their source and their index, so
+        that they can be combined row by row without a join.
+        """
+        if len(self._index) != len(other._index):
+            return False
+        source, lineage = self._source()
+        other_source, other_lineage = other._source()
+        lhs = lineage[:len(self._index)]
+        rhs = other_lineage[:len(other._index)]
+        lifted = lift(rhs, other_source, source)
+        if lifted is not None:
+            rhs = lifted
+        else:
+            lhs = lift(lhs, source, other_source)
+            if lhs is None:
+                return False
+        return all(a.compare(b) for a, b in zip(lhs, rhs))
+
+    def _materialize(self, lineages, source):
+        """
+        Compute lineages, the lineages of aligned frames rewritten over
+        source, in an extension of source, see extend(), rather than
+        inlining them once more. Return (the extension, the lineages
+        rewritten over it). The indexes, which are the same in every
+        lineage, are rewritten rather than computed, so that the frames
+        stay aligned with the other frames of source.
+        """
+        n = len(self._index)
+        computed = [e for lineage in lineages for e in lineage[n:]]
+        extended, columns = extend(source, computed)
+        idx = lift(lineages[0][:n], source, extended)
+        rewritten = []
+        for lineage in lineages:
+            size = len(lineage) - n
+            rewritten.append(idx + columns[:size])
+            columns = columns[size:]
+        return extended, rewritten
+
+    @utils.copied
+    def _project(self, exprs):
+        """
+        Replace the frame by exprs, expressions over its cte columns
+        evaluated row by row.
+        """
+        source, lineage = self._inline(exprs)
+        count = self._count_cell()
+        if not fits(lineage):
+            source, (inner, ) = self._materialize([self._source()[1]],
+                                                  self._source()[0])
+            mapping = dict(zip(map(id, self._cte.columns), inner))
+            lineage = substitute(exprs, mapping)
+        # Select straight from the source rather than layering one
+        # more CTE: only the columns used are read, and nothing such
+        # as a window over the source keeps the database from
+        # evaluating the whole projection in a single pass.
+        query = sa.select(lineage).select_from(source)
+        if source in ROW_KEYS:
+            query = query.order_by(*ROW_KEYS[source][0])
+        self._cte = lower(query)
+        self._set_lineage(source, lineage)
+        ROW_COUNTS[self._cte] = count
+
+    @utils.copied
+    def _combine(self, other, select_cols):
+        """
+        Combine self and other, two aligned frames, into the frame whose
+        index is that of self and whose columns are select_cols.
+        """
+        self._temps = self._temps | other._temps
+        exprs = self._idx() + select_cols
+        source, lineage = self._inline(exprs, other)
+        if not fits(lineage):
+            lineages = [
+                lift(frame._source()[1],
+                     frame._source()[0], source) for frame in (self, other)
+            ]
+            source, inner = self._materialize(lineages, source)
+            columns = list(self._cte.columns) + list(other._cte.columns)
+            mapping = dict(zip(map(id, columns), inner[0] + inner[1]))
+            lineage = substitute(exprs, mapping)
+        count = self._count_cell()
+        if count[0] is None:
+            count[0] = other._count_cell()[0]
+        query = sa.select(lineage).select_from(source)
+        if source in ROW_KEYS:
+            query = query.order_by(*ROW_KEYS[source][0])
+        self._cte = lower(query)
+        self._set_lineage(source, lineage)
+        ROW_COUNTS[self._cte] = count
+
+    @utils.copied
+    def _filter(self, mask, positional=False):
+        """
+        Keep the rows for which mask, a boolean Series, is true. Rows are
+        matched by index, or by position if positional is true.
+        """
+        if positional:
+            this, mask, joined = self._paste_join(mask, mask._idx_at(0))
+            query = sa.select(this._idx() + this._cols()).select_from(joined)
+            self._cte = lower(query.where(mask._col_at(0)))
+            self._temps = this._temps
+            return
+        self._temps = self._temps | mask._temps
+        if self._aligned(mask):
+            # Evaluate the mask right over the shared source, where the
+            # database can use the indexes of the underlying table.
+            exprs = list(self._cte.columns) + [mask._col_at(0)]
+            source, lineage = self._inline(exprs, mask)
+            if has_window(lineage):
+                # Window functions see the rows left by WHERE: compute
+                # them over the whole source first.
+                labeled = [e.label(None) for e in lineage]
+                source = lower(sa.select(labeled).select_from(source))
+                lineage = list(source.columns)
+            query = sa.select(lineage[:-1]).select_from(source)
+            if source in ROW_KEYS:
+                query = query.order_by(*ROW_KEYS[source][0])
+            self._cte = lower(query.where(lineage[-1]))
+            return
+        if len(self._index) != len(mask._index):
+            raise pd.core.indexing.IndexingError(
+                "Unalignable boolean Series provided as indexer")
+        join_cond = sa.and_(
+            *[lhs == rhs for lhs, rhs in zip(self._idx(), mask._idx())])
+        joined = self._cte.join(mask._cte, join_cond)
+        query = sa.select(list(self._cte.columns)).select_from(joined)
+        self._cte = lower(query.where(mask._col_at(0)))
+
+    def _fetch(self, stream=False):
+        """
+        Execute the query of the frame. If stream is true, rows are read
+        through a server-side cursor as they are consumed, instead of
+        being buffered all at once by the DBAPI.
+        """
+        return cache.execute(sa.select(self._cte), stream=stream)
+
+    def _fetch_columns(self):
+        """ Fetch the frame as NumPy arrays, one per cte column. """
+        engine = parallel.engine()
+        if engine is not None and not self._temps:
+            # Temporary tables are only visible to the connection that
+            # created them
+            queries = self._partitions(parallel.WORKERS, parallel.STRATEGY)
+            if queries is not None:
+                return parallel.fetch_columns(engine, queries,
+                                              self._cte.columns)
+        # Stream, unless the result is to be kept in the cache anyway
+        result = self._fetch(stream=not cache.enabled())
+        return columnar.fetch_columns(result, self._cte.columns)
+
+    def _iter_columns(self, batch_size=columnar.BATCH_SIZE):
+        """ Stream the frame as batches of NumPy arrays. """
+        result = self._fetch(stream=True)
+        return columnar.iter_columns(result, self._cte.columns, batch_size)
+
+    def _make_index(self, arrays):
+        """ Build a pandas Index from the fetched index arrays. """
+        if self._is_mindex:
+            return pd.MultiIndex.from_arrays(arrays, names=self._index)
+        return pd.Index(arrays[0], name=self._index[0])
 
     @utils.copied
     def _add_rowid(self):
         cte_columns = list(self._cte.columns)
         cte_columns.append(sa.func.row_number().over() - 1)
-        self._cte = sa.select(cte_columns).cte()
+        self._cte = lower(sa.select(cte_columns))
 
     def _join_cols(self, other_index, how="outer"):
         joined, l_idxer, r_idxer = self._columns.join(other_index,
@@ -67,16 +574,21 @@ class BaseFrame:
                                                       return_indexers=True)
         l_idxer = range(len(joined)) if l_idxer is None else l_idxer
         r_idxer = range(len(joined)) if r_idxer is None else r_idxer
-        return joined, zip(l_idxer, r_idxer)
+        return joined, list(zip(l_idxer, r_idxer))
 
     @utils.copied
     def _join_idx(self, other, select_cols, level=None):
+        if level is None and self._aligned(other):
+            self._combine(other, select_cols, inplace=True)
+            return
+        self._temps = self._temps | other._temps
         if not self._is_mindex and not other._is_mindex:
             join_cond = self._idx_at(0) == other._idx_at(0)
             idx = [sa.func.coalesce(self._idx_at(0), other._idx_at(0))]
-            query = dialect.CURRENT["full_outer_join"](self, other, join_cond,
-                                                       idx + select_cols)
-            self._cte = query.cte()
+            full_outer_join = dialect.CURRENT["full_outer_join"]
+            query = full_outer_join(self._cte, other._cte, join_cond,
+                                    named(idx + select_cols))
+            self._cte = lower(query)
             return
         if level is not None:
             self._join_idx_level(other, level, select_cols, inplace=True)
@@ -89,14 +601,14 @@ class BaseFrame:
             idx = other._idx()
             join_cond = self._idx_at(0) == other._lvl_at(level)
             joined = other._cte.join(self._cte, join_cond, isouter=True)
-            self._cte = sa.select(idx + select_cols).select_from(joined).cte()
+            self._cte = lower(sa.select(idx + select_cols).select_from(joined))
             self._index = other._index
             return
         if not other._is_mindex:
             idx = self._idx()
             join_cond = other._idx_at(0) == self._lvl_at(level)
             joined = self._cte.join(other._cte, join_cond, isouter=True)
-            self._cte = sa.select(idx + select_cols).select_from(joined).cte()
+            self._cte = lower(sa.select(idx + select_cols).select_from(joined))
             return
         raise TypeError("Join on level between two "
                         "MultiIndex objects is ambiguous")
@@ -118,6 +630,7 @@ class BaseFrame:
     @utils.copied
     def _paste_join(self, other, other_rowid=None):
         """ Join two BaseFrame on rowid. """
+        self._temps = self._temps | other._temps
         self._add_rowid(inplace=True)
         if other_rowid is None:
             other = other._add_rowid()
@@ -128,4 +641,7 @@ class BaseFrame:
         return self, other, joined
 
 
-__all__ = ["BaseFrame"]
+__all__ = [
+    "ROW_COUNTS", "ROW_KEYS", "set_row_key", "uses", "substitute",
+    "expression_size", "has_window", "fits", "lower", "named", "BaseFrame"
+]
@@ -0,0 +1,132 @@
+import sys
+import math
+import collections
+import sqlalchemy as sa
+from . import db
+
+MAX_BYTES = None
+ENTRIES = collections.OrderedDict()
+STATS = {"hits": 0, "misses": 0, "bytes": 0}
+# Stands for NaN in cache keys, as NaN is not equal to itself
+NAN = object()
+
+
+def enable_cache(max_bytes=64 * 2**20):
+    """
+    Keep the results of queries, up to an estimated max_bytes in total,
+    and answer identical queries from them. Least recently used results
+    are evicted first.
+
+    Results are not invalidated when tables are written to: call
+    invalidate_cache() after changing a table the frames read from.
+    """
+    global MAX_BYTES
+    MAX_BYTES = max_bytes
+    evict()
+
+
+def disable_cache():
+    global MAX_BYTES
+    MAX_BYTES = None
+    invalidate_cache()
+
+
+def enabled():
+    return MAX_BYTES is not None
+
+
+def invalidate_cache(table=None):
+    """
+    Forget the results read from table, a table name or Table, or
+    every result if table is None.
+    """
+    if table is None:
+        ENTRIES.clear()
+        STATS["bytes"] = 0
+        return
+    name = table if isinstance(table, str) else table.fullname
+    for key, (_, size, tables) in list(ENTRIES.items()):
+        if name in tables:
+            del ENTRIES[key]
+            STATS["bytes"] -= size
+
+
+def cache_stats():
+    """ Return the number of hits, misses, entries and bytes used. """
+    return dict(STATS, entries=len(ENTRIES), max_bytes=MAX_BYTES)
+
+
+def evict():
+    while ENTRIES and STATS["bytes"] > MAX_BYTES:
+        _, (_, size, _) = ENTRIES.popitem(last=False)
+        STATS["bytes"] -= size
+
+
+def result_size(rows):
+    """ Estimate the memory used by rows, in bytes. """
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+    return size
+
+
+def param_key(value):
+    """ Return value as it is compared in cache keys. """
+    if isinstance(value, float) and math.isnan(value):
+        return NAN
+    return value
+
+
+def cache_key(query):
+    """
+    Return the structure of query, the same sqlalchemy caches compiled
+    statements by, along with its parameters. Return None if query is
+    not cacheable.
+    """
+    key = query._generate_cache_key()
+    if key is None:
+        return None
+    params = tuple(param_key(b.effective_value) for b in key.bindparams)
+    key = (key.key, params)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def execute(query, stream=False):
+    """
+    Execute query. If stream is true, rows are read through a server-side
+    cursor as they are consumed, and the result is not cached.
+    """
+    bind = db.metadata().bind
+    key = cache_key(query) if enabled() else None
+    if key is not None and key in ENTRIES:
+        STATS["hits"] += 1
+        ENTRIES.move_to_end(key)
+        return ENTRIES[key][0]()
+    # Elsewhere, streaming would only add a buffering layer
+    if stream and bind.dialect.supports_server_side_cursors:
+        query = query.execution_options(stream_results=True)
+    result = bind.execute(query)
+    if key is None:
+        return result
+    STATS["misses"] += 1
+    if stream:
+        return result
+    frozen = result.freeze()
+    size = result_size(frozen.data)
+    if size <= MAX_BYTES:
+        tables = {t.fullname for t in sa.sql.util.find_tables(query)}
+        ENTRIES[key] = (frozen, size, tables)
+        STATS["bytes"] += size
+        evict()
+    return frozen()
+
+
+__all__ = [
+    "MAX_BYTES", "ENTRIES", "STATS", "NAN", "enable_cache", "disable_cache",
+    "enabled", "invalidate_cache", "cache_stats", "evict", "result_size",
+    "param_key", "cache_key", "execute"
+]
@@ -1,4 +1,5 @@
 import operator
+import functools
 import sqlalchemy as sa
 from . import dialect
 
@@ -11,14 +12,31 @@ def coerce(op, lhs_type, rhs_type=None.__class__):
             COERCIONS[op] = {(lhs_type, rhs_type): f}
         else:
             COERCIONS[op][(lhs_type, rhs_type)] = f
+        resolve.cache_clear()
         return f
 
     return decorator
 
 
+@functools.lru_cache(maxsize=None)
+def resolve(op, lhs_type, rhs_type):
+    """
+    Return the coercion of op for operands of python types lhs_type and
+    rhs_type, the first registered one they match, or None.
+    """
+    for key, value in COERCIONS.get(op, {}).items():
+        if issubclass(lhs_type, key[0]) and issubclass(rhs_type, key[1]):
+            return value
+    return None
+
+
 def get_type(value):
-    if hasattr(value, 'type') and hasattr(value.type, 'python_type'):
-        return value.type.python_type
+    if hasattr(value, 'type'):
+        try:
+            return value.type.python_type
+        except (AttributeError, NotImplementedError):
+            # NullType and some dialect types have no python type
+            pass
     return type(value)
 
 
@@ -34,12 +52,15 @@ def cast(value, new_type):
 def app_op_coerced(op, lhs, rhs=None):
     if op not in COERCIONS:
         return op(lhs, rhs)
-    lhs_type = get_type(lhs)
-    rhs_type = get_type(rhs)
-    for key, value in COERCIONS[op].items():
-        if issubclass(lhs_type, key[0]) and issubclass(rhs_type, key[1]):
-            return value(op, lhs, rhs)
-    return op(lhs, rhs)
+    coercion = resolve(op, get_type(lhs), get_type(rhs))
+    if coercion is None:
+        return op(lhs, rhs)
+    return coercion(op, lhs, rhs)
+
+
+def app_ops_coerced(op, lhss, rhss):
+    """ Apply op to each pair of lhss and rhss, see app_op_coerced(). """
+    return [app_op_coerced(op, lhs, rhs) for lhs, rhs in zip(lhss, rhss)]
 
 
 NUMERIC = (int, float, complex)
@@ -51,13 +72,14 @@ def sane_division(lhs, rhs, floor=False):
     rhs = sa.cast(rhs, sa.FLOAT)
     is_inf = dialect.CURRENT["is_inf"]
     is_nan = dialect.CURRENT["is_nan"]
-    sign = sa.func.sign
+    sign = dialect.CURRENT["sign"]
+    quotient = dialect.CURRENT["floor"](lhs / rhs) if floor else lhs / rhs
     # Ideally we should be able to handle 0.0 vs -0.0, but due to
     # the limitations of SQL we will just treat them all as 0.0
     return sa.case((is_inf(lhs) & is_inf(rhs), float('nan')),
                    (is_nan(lhs), lhs), (is_inf(rhs), 0.0),
                    (rhs == 0, sign(lhs) * float("inf")),
-                   else_=sa.func.floor(lhs / rhs) if floor else lhs / rhs)
+                   else_=quotient)
 
 
 @coerce(operator.truediv, NUMERIC, NUMERIC)
@@ -78,7 +100,7 @@ def mod_numeric(_, lhs, rhs):
     rhs = sa.cast(rhs, sa.FLOAT)
     is_inf = dialect.CURRENT["is_inf"]
     is_nan = dialect.CURRENT["is_nan"]
-    sign = sa.func.sign
+    sign = dialect.CURRENT["sign"]
     return sa.case((is_inf(lhs) | is_nan(lhs) | (rhs == 0), float("nan")),
                    (is_inf(rhs) & (sign(lhs) == -sign(rhs)), rhs),
                    (is_inf(rhs) & (sign(lhs) != -sign(rhs)), lhs),
@@ -116,4 +138,7 @@ def op_numeric_bool(op, lhs, rhs):
     return app_op_coerced(op, lhs, rhs)
 
 
-__all__ = ['COERCIONS', 'coerce', 'app_op_coerced']
+__all__ = [
+    'COERCIONS', 'coerce', 'resolve', 'get_type', 'cast', 'app_op_coerced',
+    'app_ops_coerced'
+]
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from . import dialect
+
+BATCH_SIZE = 10000
+NUMPY_TYPES = {int: np.int64, float: np.float64}
+
+
+def numpy_type(column):
+    """
+    Return the NumPy dtype used to preallocate column.
+
+    Only types whose values can be stored without loss are mapped.
+    Everything else (including columns without a known python_type)
+    is fetched as object and has its dtype inferred afterwards.
+    """
+    try:
+        return NUMPY_TYPES.get(column.type.python_type, object)
+    except NotImplementedError:
+        return object
+
+
+class ColumnBuilder:
+    """ Accumulate the values of a column into a typed NumPy array. """
+    def __init__(self, dtype):
+        self._data = np.empty(0, dtype=dtype)
+        self._size = 0
+
+    def _reserve(self, n):
+        needed = self._size + n
+        if needed > len(self._data):
+            capacity = max(needed, 2 * len(self._data))
+            data = np.empty(capacity, dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def extend(self, values):
+        self._reserve(len(values))
+        end = self._size + len(values)
+        array = np.asarray(values)
+        if array.dtype.kind in "US":
+            # NumPy turns values of mixed types into strings
+            array = np.asarray(values, dtype=object)
+        if array.dtype == object and self._data.dtype.kind == "f":
+            # NULL in a float column is NaN, as in pandas
+            if all(v is None or isinstance(v, (int, float)) for v in values):
+                array = np.array(values, dtype=self._data.dtype)
+        if not np.can_cast(array.dtype, self._data.dtype):
+            # NULL in an integer column, or a value the declared
+            # type does not describe (SQLite is dynamically typed).
+            self._data = self._data.astype(object)
+        self._data[self._size:end] = array
+        self._size = end
+
+    def finish(self):
+        data = self._data[:self._size]
+        if data.dtype == object:
+            # Same inference pd.DataFrame.from_records() would do
+            return pd.Series(data, dtype=object).infer_objects().to_numpy()
+        return data
+
+
+def raw_cursor(result, columns):
+    """
+    Return the DBAPI cursor of result if rows can be read from it
+    directly, that is when none of columns needs result processing.
+    Otherwise, return None. Streamed results buffer rows on their own,
+    so their cursors are not used either.
+    """
+    cursor = getattr(result, "cursor", None)
+    if cursor is None:
+        return None
+    strategy = getattr(result, "cursor_strategy", None)
+    if type(strategy) is not sa.engine.cursor.CursorFetchStrategy:
+        return None
+    dialect_ = result.context.dialect
+    for c in columns:
+        # The generic type may need no processing where the type of the
+        # dialect does, such as Date on SQLite
+        impl = c.type.dialect_impl(dialect_)
+        if impl.result_processor(dialect_, None) is not None:
+            return None
+    return cursor
+
+
+def row_source(result, columns):
+    """
+    Return the fetchmany() function to read rows of result from, that
+    of the DBAPI cursor when possible, skipping the construction of Row
+    objects.
+    """
+    cursor = raw_cursor(result, columns)
+    return result.fetchmany if cursor is None else cursor.fetchmany
+
+
+def from_array(array, dtype):
+    """
+    Convert array, as returned by dialect fetch_arrays(), to what a
+    ColumnBuilder of dtype makes of the same values.
+    """
+    if np.ma.isMaskedArray(array):
+        mask = np.ma.getmaskarray(array)
+        array = np.ma.getdata(array)
+        if mask.any():
+            array = array.astype(object)
+            array[mask] = None
+    if array.dtype == dtype:
+        return array
+    builder = ColumnBuilder(dtype)
+    builder.extend(array)
+    return builder.finish()
+
+
+def fetch_columns(result, columns, batch_size=BATCH_SIZE):
+    """
+    Fetch result in batches of batch_size rows and return a list
+    of NumPy arrays, one for each of columns.
+    """
+    cursor = raw_cursor(result, columns)
+    if cursor is not None:
+        arrays = dialect.CURRENT["fetch_arrays"](cursor)
+        if arrays is not None:
+            result.close()
+            return [
+                from_array(a, numpy_type(c)) for a, c in zip(arrays, columns)
+            ]
+    builders = [ColumnBuilder(numpy_type(c)) for c in columns]
+    fetchmany = row_source(result, columns)
+    while True:
+        rows = fetchmany(batch_size)
+        if not rows:
+            break
+        for builder, values in zip(builders, zip(*rows)):
+            builder.extend(values)
+    result.close()
+    return [b.finish() for b in builders]
+
+
+def iter_columns(result, columns, batch_size=BATCH_SIZE):
+    """
+    Fetch result in batches of at most batch_size rows. For each batch,
+    yield a list of NumPy arrays, one for each of columns.
+    """
+    dtypes = [numpy_type(c) for c in columns]
+    fetchmany = row_source(result, columns)
+    try:
+        while True:
+            rows = fetchmany(batch_size)
+            if not rows:
+                break
+            arrays = []
+            for dtype, values in zip(dtypes, zip(*rows)):
+                builder = ColumnBuilder(dtype)
+                builder.extend(values)
+                arrays.append(builder.finish())
+            yield arrays
+    finally:
+        # Also when the caller stops iterating early
+        result.close()
+
+
+__all__ = [
+    "BATCH_SIZE", "numpy_type", "ColumnBuilder", "raw_cursor", "row_source",
+    "from_array", "fetch_columns", "iter_columns"
+]
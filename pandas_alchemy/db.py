@@ -16,14 +16,22 @@ def init_db(*args, **kwargs):
         raise RuntimeError("Already connected")
     engine = sa.create_engine(*args, **kwargs)
     dialect.augment_engine(engine)
-    METADATA = sa.MetaData(engine)
+    # Bind to a single connection so that temporary tables
+    # stay visible for the rest of the session.
+    METADATA = sa.MetaData(engine.connect())
 
 
 def close_db():
+    from . import temp
+    from . import cache
     global METADATA
     if METADATA is None:
         raise RuntimeError("Not connected")
-    METADATA.bind.dispose()
+    connection = METADATA.bind
+    connection.close()
+    connection.engine.dispose()
+    temp.reset()
+    cache.invalidate_cache()
     METADATA = None
 
 
@@ -2,10 +2,12 @@ import math
 import copy
 import pandas as pd
 import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
 
 AUGMENTATION = {}
 POLYFILL = {}
 CURRENT = None
+PROBES = {}
 
 
 def augment_engine(engine):
@@ -15,12 +17,20 @@ def augment_engine(engine):
         aug(engine)
 
 
-def augment(db_name):
+def augment(db_name, when=None):
+    """
+    Register f to augment engines of db_name. If when is not None,
+    f only applies to engines for which when(engine) is true.
+    """
     def decorator(f):
+        def aug(engine):
+            if when is None or when(engine):
+                f(engine)
+
         if db_name not in AUGMENTATION:
-            AUGMENTATION[db_name] = [f]
+            AUGMENTATION[db_name] = [aug]
         else:
-            AUGMENTATION[db_name].append(f)
+            AUGMENTATION[db_name].append(aug)
         return f
 
     return decorator
@@ -42,13 +52,88 @@ def refill(name):
 
 
 def with_raw_connection(f):
+    """ Call f with every DBAPI connection the engine opens. """
     def raw_connection(engine):
-        con = engine.raw_connection().connection
-        return f(con)
+        sa.event.listen(engine, "connect", lambda con, _: f(con))
 
     return raw_connection
 
 
+def sqlite_version(engine):
+    return engine.dialect.dbapi.sqlite_version_info
+
+
+def sqlite_before(*version):
+    return lambda engine: sqlite_version(engine) < version
+
+
+def server_version(engine):
+    if engine.dialect.server_version_info is None:
+        # Only known once connected
+        engine.connect().close()
+    return engine.dialect.server_version_info
+
+
+def server_before(*version):
+    return lambda engine: server_version(engine) < version
+
+
+def probe(engine, statement):
+    """
+    Run statement on the database of engine and return the rows it
+    fetches, or None if it fails. The statement runs on a DBAPI
+    connection of its own, untouched by the augmentations, and its
+    outcome is remembered for the database.
+    """
+    key = (str(engine.url), statement)
+    if key not in PROBES:
+        dbapi = engine.dialect.dbapi
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        con = dbapi.connect(*cargs, **cparams)
+        try:
+            cursor = con.cursor()
+            cursor.execute(statement)
+            PROBES[key] = cursor.fetchall()
+        except dbapi.Error:
+            PROBES[key] = None
+        finally:
+            con.close()
+    return PROBES[key]
+
+
+def supports(statement):
+    """ Whether engine runs statement, as the when of an augmentation. """
+    return lambda engine: probe(engine, statement) is not None
+
+
+# Whether SQLite is built with SQLITE_ENABLE_MATH_FUNCTIONS
+sqlite_math_functions = supports("SELECT floor(1.5)")
+
+
+def sqlite_indexed_full_join(engine):
+    """
+    Whether SQLite runs FULL OUTER JOIN (since 3.39), and can look rows
+    up through an automatic index when doing so. Frames are read from
+    CTEs, which have no index of their own: without one, every row of
+    one side is matched by scanning the other.
+    """
+    plan = probe(
+        engine, "EXPLAIN QUERY PLAN "
+        "WITH l AS (SELECT name AS x FROM sqlite_master), "
+        "r AS (SELECT name AS x FROM sqlite_master) "
+        "SELECT * FROM l FULL OUTER JOIN r ON l.x = r.x")
+    return plan is not None and any("AUTOMATIC" in row[-1] for row in plan)
+
+
+def sqlite_create_function(con, name, num_params, func):
+    try:
+        # Lets SQLite factor calls with constant arguments out of loops
+        con.create_function(name, num_params, func, deterministic=True)
+    except (TypeError, con.NotSupportedError):
+        # Python < 3.8 or SQLite < 3.8.3
+        con.create_function(name, num_params, func)
+
+
 @polyfill
 def full_outer_join(lhs, rhs, cond, selects):
     left = sa.select(selects).select_from(lhs.join(rhs, cond, isouter=True))
@@ -57,31 +142,128 @@ def full_outer_join(lhs, rhs, cond, selects):
 
 
 @augment("postgresql")
+@augment("duckdb")
+@augment("sqlite", when=sqlite_indexed_full_join)
 @refill("full_outer_join")
 def postgresql_full_outer_join(lhs, rhs, cond, selects):
     return sa.select(selects).select_from(lhs.join(rhs, cond, full=True))
 
 
 @polyfill
-def is_inf(value):
-    return False
+def lower(query):
+    """
+    Return the FROM clause element a frame selects its rows from, given
+    the SELECT it is defined by. Frames build upon each other, so this is
+    how a pipeline nests: by default, as a chain of CTEs.
+    """
+    return query.cte()
+
+
+@augment("postgresql", when=server_before(12))
+@refill("lower")
+def postgresql_lower(query):
+    # CTEs are optimization fences before PostgreSQL 12: they are always
+    # computed in full, while subqueries are planned along with the
+    # query around them.
+    return query.subquery()
+
+
+@augment("mysql", when=server_before(8))
+@refill("lower")
+def mysql_lower(query):
+    # No CTEs before MySQL 8
+    return query.subquery()
+
+
+@polyfill
+def materialize(query):
+    """
+    Return the FROM clause element of a SELECT computing expressions too
+    large to be inlined once more, see base.extend(). By default, as
+    lower() does.
+    """
+    return CURRENT["lower"](query)
+
+
+@augment("postgresql", when=lambda engine: not server_before(12)(engine))
+@augment("duckdb")
+@augment("sqlite", when=lambda engine: not sqlite_before(3, 35)(engine))
+@refill("materialize")
+def postgresql_materialize(query):
+    # Otherwise the CTE is flattened into the query reading it, which
+    # inlines the expressions once more, and doubles the work with every
+    # SELECT in a chain of them referring more than once to a column.
+    return query.cte().prefix_with("MATERIALIZED")
+
+
+@polyfill
+def row_key(tbl):
+    """
+    Return the columns ordering the rows of tbl consistently, that is
+    its primary key, or an empty list if there are none.
+    """
+    return list(tbl.primary_key.columns)
+
+
+def physical_row_key(tbl, name):
+    """
+    Return the primary key of tbl, or else its system column name
+    locating rows physically. Views have no such column.
+    """
+    if tbl.primary_key.columns or tbl.info.get("view", True):
+        return list(tbl.primary_key.columns)
+    return [sa.sql.expression.ColumnClause(name, _selectable=tbl)]
 
 
 @augment("sqlite")
-@with_raw_connection
-def sqlite_is_inf_function(con):
-    def is_inf_func(value):
-        if value is None:
-            return False
-        return math.isinf(value)
+@refill("row_key")
+def sqlite_row_key(tbl):
+    return physical_row_key(tbl, "rowid")
+
+
+@augment("postgresql")
+@refill("row_key")
+def postgresql_row_key(tbl):
+    return physical_row_key(tbl, "ctid")
+
+
+@augment("duckdb")
+@refill("row_key")
+def duckdb_row_key(tbl):
+    return physical_row_key(tbl, "rowid")
+
+
+@polyfill
+def max_expression_size():
+    """
+    Largest expression, in sqlalchemy nodes, inlined into another one.
+    Past it, expressions are referred to as columns of a SELECT instead.
+    """
+    return 500
 
-    con.create_function("is_inf", 1, is_inf_func)
+
+@augment("sqlite")
+@refill("max_expression_size")
+def sqlite_max_expression_size():
+    # Keep well within SQLITE_MAX_EXPR_DEPTH
+    return 250
+
+
+@augment("postgresql")
+@refill("max_expression_size")
+def postgresql_max_expression_size():
+    return 2000
+
+
+@polyfill
+def is_inf(value):
+    return sa.false()
 
 
 @augment("sqlite")
 @refill("is_inf")
 def sqlite_is_inf(value):
-    return sa.func.is_inf(value)
+    return value.in_((sa.literal(float('inf')), sa.literal(float('-inf'))))
 
 
 @augment("postgresql")
@@ -90,26 +272,30 @@ def postgresql_is_inf(value):
     return value.in_((sa.literal(float('inf')), sa.literal(float('-inf'))))
 
 
-@polyfill
-def is_nan(value):
-    return False
+@compiles(sa.Float, "duckdb")
+@compiles(sa.FLOAT, "duckdb")
+def duckdb_float(type_, compiler, **kw):
+    # FLOAT is single precision in DuckDB, unlike Python and NumPy floats
+    return "DOUBLE"
 
 
-@augment("sqlite")
-@with_raw_connection
-def sqlite_is_nan_function(con):
-    def is_nan_func(value):
-        if value is None:
-            return True
-        return math.isnan(value)
+@augment("duckdb")
+@refill("is_inf")
+def duckdb_is_inf(value):
+    # Only defined for floating point numbers, not for booleans
+    return sa.func.isinf(sa.cast(value, sa.FLOAT))
 
-    con.create_function("is_nan", 1, is_nan_func)
+
+@polyfill
+def is_nan(value):
+    return sa.false()
 
 
 @augment("sqlite")
 @refill("is_nan")
 def sqlite_is_nan(value):
-    return sa.func.is_nan(value)
+    # SQLite stores NaN as NULL
+    return value.is_(None)
 
 
 @augment("postgresql")
@@ -118,50 +304,178 @@ def postgresql_is_nan(value):
     return value == sa.literal(float("nan"))
 
 
-@augment("sqlite")
-@with_raw_connection
-def sqlite_sign_function(con):
-    def sign_func(value):
-        if value == 0:
-            return 0
-        elif value > 0:
-            return 1
-        elif value < 0:
-            return -1
+@augment("duckdb")
+@refill("is_nan")
+def duckdb_is_nan(value):
+    return sa.func.isnan(sa.cast(value, sa.FLOAT))
+
 
-    con.create_function("sign", 1, sign_func)
+@polyfill
+def sign(value):
+    return sa.func.sign(value)
 
 
-@augment("sqlite")
+@augment("sqlite", when=sqlite_before(3, 35))
+@refill("sign")
+def sqlite_sign(value):
+    return sa.case((value > 0, 1), (value < 0, -1), (value == 0, 0))
+
+
+@polyfill
+def floor(value):
+    return sa.func.floor(value)
+
+
+@augment("sqlite", when=lambda engine: not sqlite_math_functions(engine))
 @with_raw_connection
 def sqlite_floor_function(con):
-    con.create_function("floor", 1, math.floor)
+    sqlite_create_function(con, "floor", 1, math.floor)
 
 
-@augment("sqlite")
+@polyfill
+def sqrt(value):
+    return sa.func.sqrt(value)
+
+
+@augment("sqlite", when=lambda engine: not sqlite_math_functions(engine))
 @with_raw_connection
-def sqlite_greatest_function(con):
-    def greatest_func(*args):
-        result = args[0]
-        for i in args:
-            if i is not None and i > result:
-                result = i
-        return result
+def sqlite_sqrt_function(con):
+    def sqrt(value):
+        return None if value is None or value < 0 else math.sqrt(value)
+
+    sqlite_create_function(con, "sqrt", 1, sqrt)
+
+
+@polyfill
+def greatest(*args):
+    return sa.func.greatest(*args)
+
+
+@polyfill
+def least(*args):
+    return sa.func.least(*args)
+
 
-    con.create_function("greatest", -1, greatest_func)
+@polyfill
+def var(value, ddof):
+    """
+    Variance of value, with n - ddof degrees of freedom, as an aggregate.
+    Uses the two-pass formula: the mean is a window, which callers
+    compute over the rows before aggregating, see base.windowed(). The
+    one-pass sum(x * x) - sum(x) * sum(x) / n cancels out when the mean
+    is large compared to the spread of the values.
+    """
+    value = sa.cast(value, sa.FLOAT)
+    n = sa.func.count(value)
+    deviation = value - sa.func.avg(value).over()
+    squares = sa.func.sum(deviation * deviation)
+    return sa.case((n > ddof, squares / (n - ddof)), else_=sa.null())
+
+
+def native_var(value, ddof):
+    """ var() through var_pop() and var_samp() when ddof allows. """
+    value = sa.cast(value, sa.FLOAT)
+    if ddof == 0:
+        return sa.func.var_pop(value)
+    if ddof == 1:
+        return sa.func.var_samp(value)
+    return POLYFILL["var"](value, ddof)
+
+
+@augment("postgresql")
+@refill("var")
+def postgresql_var(value, ddof):
+    return native_var(value, ddof)
+
+
+@augment("duckdb")
+@refill("var")
+def duckdb_var(value, ddof):
+    # Infinite values make var_samp() raise an error. The variance is
+    # NaN then, which callers check for on their own.
+    value = sa.cast(value, sa.FLOAT)
+    return native_var(sa.case((sa.func.isinf(value), None), else_=value), ddof)
+
+
+@polyfill
+def fetch_arrays(cursor):
+    """
+    Fetch the remaining rows of cursor, a DBAPI cursor, as one NumPy
+    array per column, or return None if the DBAPI can only fetch rows.
+    Arrays holding NULL are masked arrays.
+    """
+    return None
+
+
+@augment("duckdb")
+@refill("fetch_arrays")
+def duckdb_fetch_arrays(cursor):
+    # DuckDB stores columns, and hands them over without making rows
+    return list(cursor.fetchnumpy().values())
+
+
+@polyfill
+def fetch_record_batches(cursor, batch_size):
+    """
+    Fetch the remaining rows of cursor, a DBAPI cursor, as an iterable
+    of Arrow RecordBatches of at most batch_size rows, or return None if
+    the DBAPI does not fetch Arrow.
+    """
+    return None
+
+
+@augment("duckdb")
+@refill("fetch_record_batches")
+def duckdb_fetch_record_batches(cursor, batch_size):
+    if hasattr(cursor, "to_arrow_reader"):
+        return cursor.to_arrow_reader(batch_size)
+    # DuckDB < 1.4
+    return cursor.fetch_record_batch(batch_size)
+
+
+@polyfill
+def parallel_fetch():
+    """
+    Whether fetching parts of a result on several connections at once
+    is faster than fetching it on one, as it is when each connection is
+    served by a database process of its own.
+    """
+    return True
 
 
 @augment("sqlite")
-@with_raw_connection
-def sqlite_least_function(con):
-    def least_func(*args):
-        result = args[0]
-        for i in args:
-            if i is not None and i < result:
-                result = i
-        return result
+@augment("duckdb")
+@refill("parallel_fetch")
+def sqlite_parallel_fetch():
+    # The database runs in this process: DuckDB already spreads queries
+    # over threads, and SQLite results are read holding the GIL.
+    return False
 
-    con.create_function("least", -1, least_func)
+
+def sqlite_ignore_nulls(func, args):
+    """
+    Apply func, the multi-argument SQLite max() or min(), to args
+    ignoring NULL, like greatest() and least() do in PostgreSQL.
+    """
+    if len(args) == 1:
+        return sa.func.coalesce(args[0])
+    args = [
+        sa.func.coalesce(arg, *args[:i], *args[i + 1:])
+        for i, arg in enumerate(args)
+    ]
+    return func(*args)
+
+
+@augment("sqlite")
+@refill("greatest")
+def sqlite_greatest(*args):
+    return sqlite_ignore_nulls(sa.func.max, args)
+
+
+@augment("sqlite")
+@refill("least")
+def sqlite_least(*args):
+    return sqlite_ignore_nulls(sa.func.min, args)
 
 
 @augment("sqlite")
@@ -183,6 +497,9 @@ def postgresql_NA_adapters(engine):
 
 
 __all__ = [
-    "AUGMENTATION", "POLYFILL", "CURRENT", "augment_engine", "augment",
-    "polyfill", "refill", "with_raw_connection"
+    "AUGMENTATION", "POLYFILL", "CURRENT", "PROBES", "augment_engine",
+    "augment", "polyfill", "refill", "with_raw_connection", "sqlite_version",
+    "sqlite_before", "server_version", "server_before", "probe", "supports",
+    "sqlite_math_functions", "sqlite_indexed_full_join",
+    "sqlite_create_function", "physical_row_key", "native_var"
 ]
@@ -1,17 +1,38 @@
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
+from . import db
+from . import temp
 from . import utils
 from . import indexer
+from . import base
+from . import aggregate
+from . import columnar
+from . import cache
+from . import arrow
+from . import reflection
 
 
 class GenericMixin:
     def __len__(self):
-        count = sa.select([sa.func.count()])
-        return count.select_from(self._cte).scalar()
+        count = self._count_cell()
+        if count[0] is None:
+            # There are as many rows as in the source, whatever the
+            # columns computed from it
+            source = self._source()[0]
+            query = sa.select([sa.func.count()]).select_from(source)
+            count[0] = cache.execute(query).scalar()
+        return count[0]
 
     @property
     def empty(self):
-        return len(self) == 0
+        count = self._count_cell()[0]
+        if count is None:
+            # No need to count every row just to find one
+            source = self._source()[0]
+            exists = sa.select([sa.literal(1)]).select_from(source)
+            return not cache.execute(sa.select([exists.exists()])).scalar()
+        return count == 0
 
     @property
     def shape(self):
@@ -23,7 +44,7 @@ class GenericMixin:
 
     @property
     def index(self):
-        data = sa.select(self._idx()).execute()
+        data = cache.execute(sa.select(self._idx()))
         if self._is_mindex:
             return pd.MultiIndex(data, names=self._index)
         return pd.Index(data.scalars(), name=self._index[0])
@@ -32,6 +53,148 @@ class GenericMixin:
     def iat(self):
         return indexer._iAtIndexer(self)
 
+    @property
+    def loc(self):
+        return indexer._LocIndexer(self)
+
+    def to_pandas(self, chunksize=None):
+        """
+        Fetch the frame into its pandas counterpart. If chunksize is not
+        None, return an iterator over pieces of chunksize rows instead,
+        see iter_batches().
+        """
+        if chunksize is not None:
+            return self.iter_batches(chunksize)
+        return self._to_pandas(self._fetch_columns())
+
+    def iter_batches(self, batch_size=columnar.BATCH_SIZE):
+        """
+        Stream the frame as pandas objects of at most batch_size rows,
+        so that memory use does not grow with the size of the frame.
+        """
+        for arrays in self._iter_columns(batch_size):
+            yield self._to_pandas(arrays)
+
+    def _arrow_schema(self):
+        """
+        Return the Arrow schema of the frame, fields untyped, and the
+        positions of its fields among the cte columns. The schema holds
+        the pandas metadata restoring the index in to_pandas().
+        """
+        pa = arrow.pyarrow()
+        columns = self._cte.columns
+        empty = self._to_pandas(
+            [np.empty(0, columnar.numpy_type(c)) for c in columns])
+        if self.ndim == 1:
+            empty = empty.to_frame()
+        schema = pa.Schema.from_pandas(empty, preserve_index=True)
+        n_index = len(self._index)
+        order = list(range(n_index, len(columns))) + list(range(n_index))
+        return schema, order
+
+    def iter_record_batches(self, batch_size=columnar.BATCH_SIZE):
+        """
+        Stream the frame as Arrow RecordBatches of at most batch_size
+        rows, index columns included. Requires pyarrow.
+        """
+        schema, order = self._arrow_schema()
+        result = self._fetch(stream=True)
+        return arrow.iter_record_batches(result, self._cte.columns, schema,
+                                         order, batch_size)
+
+    def to_arrow(self):
+        """ Fetch the frame into an Arrow Table. Requires pyarrow. """
+        pa = arrow.pyarrow()
+        return pa.Table.from_batches(self.iter_record_batches())
+
+    @utils.copied
+    def persist(self, index=True):
+        """
+        Compute the frame once and store it into a temporary table, from
+        which it is read afterwards. If index is true, index the table on
+        the index columns of the frame. The table is dropped along with
+        the last frame reading from it.
+        """
+        count = self._count_cell()
+        n_index = len(self._index) if index else 0
+        tbl, handle = temp.persist(self._cte.columns, n_index)
+        base.set_row_key(tbl, [tbl.columns.pos])
+        self._cte = base.lower(temp.select(tbl))
+        self._temps = frozenset((handle, ))
+        self._set_lineage(tbl, list(tbl.columns)[1:])
+        base.ROW_COUNTS[self._cte] = count
+
+    cache = persist
+
+    def _sql_names(self, index, index_label):
+        """
+        Return the column names to_sql() gives the index, if index is
+        true, and the columns of the frame, named as pandas would.
+        """
+        names = []
+        if index:
+            if index_label is None:
+                if len(self._index) == 1:
+                    index_label = [
+                        "index" if self._index[0] is None else self._index[0]
+                    ]
+                else:
+                    index_label = [
+                        f"level_{i}" if n is None else n
+                        for i, n in enumerate(self._index)
+                    ]
+            elif not pd.api.types.is_list_like(index_label):
+                index_label = [index_label]
+            if len(index_label) != len(self._index):
+                raise ValueError("Length of 'index_label' should match "
+                                 "number of levels, which is "
+                                 f"{len(self._index)}")
+            names += [str(n) for n in index_label]
+        if self.ndim == 1 and self._columns[0] is None:
+            names.append("0")
+        else:
+            names += [str(c) for c in self._columns]
+        duplicated = pd.Index(names)[pd.Index(names).duplicated()]
+        if len(duplicated):
+            raise ValueError(f"Duplicate column names {list(duplicated)}")
+        return names
+
+    def to_sql(self,
+               name,
+               schema=None,
+               if_exists="fail",
+               index=True,
+               index_label=None):
+        """
+        Write the frame into the table name of schema, without fetching
+        it: the table is created from the query of the frame, or filled
+        by it if if_exists is "append". The index is written as columns
+        if index is true, named index_label, or after its levels.
+        """
+        if if_exists not in ("fail", "replace", "append"):
+            raise ValueError(f"'{if_exists}' is not valid for if_exists")
+        names = self._sql_names(index, index_label)
+        columns = list(self._cte.columns)
+        if not index:
+            columns = columns[len(self._index):]
+        query = sa.select([c.label(n) for c, n in zip(columns, names)])
+        bind = db.metadata().bind
+        exists = sa.inspect(bind).has_table(name, schema=schema)
+        if exists and if_exists == "fail":
+            raise ValueError(f"Table '{name}' already exists.")
+        if exists and if_exists == "append":
+            tbl = reflection.table(name, schema)
+            bind.execute(tbl.insert().from_select(names, query))
+        else:
+            tbl = sa.Table(name, sa.MetaData(), schema=schema)
+            if exists:
+                tbl.drop(bind)
+            bind.execute(temp.CreateTableAs(tbl, query, temporary=False))
+        reflection.invalidate_reflection(name, schema)
+        cache.invalidate_cache(tbl)
+
+    to_table = to_sql
+
     def bool(self):
         if self.size != 1:
             raise ValueError(f"The truth value of a {self.__class.__name__} "
@@ -45,26 +208,47 @@ class GenericMixin:
 
     @utils.copied
     def head(self, n=5):
-        self._cte = sa.select(self._cte).limit(n).cte()
+        count = self._count_cell()[0]
+        if self._keyed() is not None and n >= 0:
+            self._set_page(self._page(n))
+        else:
+            self._cte = base.lower(sa.select(self._cte).limit(n))
+        if count is not None:
+            self._set_row_count(min(count, n))
 
     @utils.copied
     def tail(self, n=5):
-        offset = max(0, len(self) - n)
+        keyed = self._keyed()
+        if keyed is not None and n >= 0:
+            _, exprs, _, position = keyed
+            count = self._count_cell()[0]
+            offset = 0
+            if base.uses(exprs, position):
+                # Number the last rows as the whole frame would
+                count = len(self)
+                offset = max(0, count - n)
+            self._set_page(self._page(n, offset=offset, last=True))
+            if count is not None:
+                self._set_row_count(min(count, n))
+            return
+        count = len(self)
+        offset = max(0, count - n)
         query = sa.select(self._cte).limit(n)
         if offset:
-            self._cte = query.offset(offset).cte()
+            self._cte = base.lower(query.offset(offset))
         else:
-            self._cte = query.cte()
+            self._cte = base.lower(query)
+        self._set_row_count(min(count, n))
 
     @utils.copied
     def _cast(self, new_type):
         cols = [sa.cast(c, new_type) for c in self._cols()]
-        self._cte = sa.select(self._idx() + cols).cte()
+        self._project(self._idx() + cols, inplace=True)
 
     @utils.copied
     def _app(self, func):
         cols = [func(c) for c in self._cols()]
-        self._cte = sa.select(self._idx() + cols).cte()
+        self._project(self._idx() + cols, inplace=True)
 
     @utils.copied
     def isna(self):
@@ -89,6 +273,115 @@ class GenericMixin:
             return func(*args, **kwargs)
         return func(self, *args, **kwargs)
 
+    def _reduce(self,
+                name,
+                axis=None,
+                skipna=True,
+                level=None,
+                numeric_only=None,
+                **kwargs):
+        """
+        Compute the reduction name of every column in one aggregate
+        SELECT. Return a scalar for a Series, and a pandas Series
+        indexed by the columns for a DataFrame.
+        """
+        if axis not in (None, 0, "index"):
+            raise NotImplementedError
+        if level is not None:
+            raise NotImplementedError
+        build, numeric = aggregate.REDUCTIONS[name]
+        if name != "count":
+            kwargs["skipna"] = skipna
+        cols = self._cols()
+        locs = list(range(len(cols)))
+        if self.ndim == 2 and (numeric_only
+                               or numeric_only is None and numeric):
+            locs = [i for i in locs if aggregate.is_numeric(cols[i])]
+        if not locs:
+            return pd.Series([], index=self._columns[locs], dtype=float)
+        source, exprs = self._inline([cols[i] for i in locs])
+        if base.has_window(exprs):
+            # Window functions cannot be nested in aggregates
+            source, exprs = self._cte, [cols[i] for i in locs]
+        built = [build(e, **kwargs) for e in exprs]
+        source, aggs = base.windowed(source, [agg for agg, _ in built])
+        query = sa.select(aggs).select_from(source)
+        row = cache.execute(query).first()
+        values = [finish(v) for (_, finish), v in zip(built, row)]
+        if self.ndim == 1:
+            return values[0]
+        values = pd.Series(values, index=self._columns[locs], dtype=object)
+        return values.infer_objects()
+
+    def sum(self,
+            axis=None,
+            skipna=True,
+            level=None,
+            numeric_only=None,
+            min_count=0,
+            **kwargs):
+        return self._reduce("sum",
+                            axis,
+                            skipna,
+                            level,
+                            numeric_only,
+                            min_count=min_count)
+
+    def mean(self,
+             axis=None,
+             skipna=True,
+             level=None,
+             numeric_only=None,
+             **kwargs):
+        return self._reduce("mean", axis, skipna, level, numeric_only)
+
+    def min(self,
+            axis=None,
+            skipna=True,
+            level=None,
+            numeric_only=None,
+            **kwargs):
+        return self._reduce("min", axis, skipna, level, numeric_only)
+
+    def max(self,
+            axis=None,
+            skipna=True,
+            level=None,
+            numeric_only=None,
+            **kwargs):
+        return self._reduce("max", axis, skipna, level, numeric_only)
+
+    def count(self, axis=0, level=None, numeric_only=False):
+        return self._reduce("count", axis, True, level, numeric_only)
+
+    def var(self,
+            axis=None,
+            skipna=True,
+            level=None,
+            ddof=1,
+            numeric_only=None,
+            **kwargs):
+        return self._reduce("var",
+                            axis,
+                            skipna,
+                            level,
+                            numeric_only,
+                            ddof=ddof)
+
+    def std(self,
+            axis=None,
+            skipna=True,
+            level=None,
+            ddof=1,
+            numeric_only=None,
+            **kwargs):
+        return self._reduce("std",
+                            axis,
+                            skipna,
+                            level,
+                            numeric_only,
+                            ddof=ddof)
+
     isnull = isna
     notnull = notna
 
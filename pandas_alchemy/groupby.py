@@ -0,0 +1,217 @@
+import pandas as pd
+import sqlalchemy as sa
+from . import base
+from . import alchemy
+from . import aggregate
+
+
+class GroupBy:
+    """
+    Groups of the rows of obj, a DataFrame or Series, sharing the same
+    keys. Aggregating them compiles to a GROUP BY, and the result is a
+    DataFrame or Series indexed by the keys.
+    """
+    def __init__(self, obj, by=None, level=None, sort=True, dropna=True):
+        if by is None and level is None:
+            raise TypeError("You have to supply one of 'by' and 'level'")
+        self._obj = obj
+        self._sort = sort
+        self._dropna = dropna
+        # [(name, cte column of obj)]
+        self._keys = []
+        key_locs = set()
+        if level is not None:
+            levels = level if pd.api.types.is_list_like(level) else [level]
+            for lvl in levels:
+                i = obj._lvl_loc(lvl)
+                self._keys.append((obj._index[i], obj._idx_at(i)))
+        if isinstance(by, base.BaseFrame):
+            # Grouping by the values of another frame is not supported
+            raise NotImplementedError
+        if by is not None:
+            labels = by if pd.api.types.is_list_like(by) else [by]
+            for label in labels:
+                if isinstance(label, base.BaseFrame):
+                    raise NotImplementedError
+                if obj.ndim == 2 and label in obj._columns:
+                    i = obj._columns.get_loc(label)
+                    self._keys.append((label, obj._col_at(i)))
+                    key_locs.add(i)
+                elif label in obj._index:
+                    i = obj._index.get_loc(label)
+                    self._keys.append((label, obj._idx_at(i)))
+                else:
+                    raise KeyError(label)
+        # Positions of the columns of obj to be aggregated
+        self._locs = [i for i in range(len(obj._columns)) if i not in key_locs]
+
+    def _select(self, locs, cls=None):
+        """ Return a copy of self aggregating the columns at locs only. """
+        result = object.__new__(cls or self.__class__)
+        result.__dict__.update(self.__dict__)
+        result._locs = locs
+        return result
+
+    def _labels(self):
+        return self._obj._columns[self._locs]
+
+    def _aggregate(self, specs, columns):
+        """
+        Aggregate the groups with specs, a list of (loc, reduction name,
+        kwargs) where loc is the position of a column of obj, or None
+        for the size of the groups. Return a DataFrame whose columns
+        are labeled by columns, indexed by the group keys.
+        """
+        obj = self._obj
+        keys = [expr for _, expr in self._keys]
+        values = [obj._col_at(loc) for loc, _, _ in specs if loc is not None]
+        source, exprs = obj._inline(keys + values)
+        if base.has_window(exprs):
+            # Window functions cannot be nested in aggregates
+            source, exprs = obj._cte, keys + values
+        keys, values = exprs[:len(keys)], iter(exprs[len(keys):])
+        aggs = []
+        for loc, name, kwargs in specs:
+            if loc is None:
+                aggs.append(sa.func.count())
+            else:
+                build = aggregate.REDUCTIONS[name][0]
+                aggs.append(build(next(values), **kwargs)[0])
+        source, exprs = base.windowed(source, keys + aggs, partition_by=keys)
+        keys, aggs = exprs[:len(keys)], exprs[len(keys):]
+        labeled = [e.label(None) for e in keys + aggs]
+        query = sa.select(labeled).select_from(source).group_by(*keys)
+        if self._dropna:
+            # Like pandas, drop the groups whose keys are NA
+            query = query.where(
+                sa.and_(*[aggregate.valid(k).is_not(None) for k in keys]))
+        if self._sort:
+            # NA keys, if kept, come last as in pandas
+            order = [] if self._dropna else [k.is_(None) for k in keys]
+            query = query.order_by(*order, *keys)
+        index = pd.Index([name for name, _ in self._keys])
+        if not isinstance(columns, pd.Index):
+            columns = pd.Index(columns)
+        df = alchemy.DataFrame(index, columns, base.lower(query))
+        df._temps = obj._temps
+        return df
+
+    def _reduce(self, name, numeric_only=None, **kwargs):
+        locs = self._locs
+        numeric = aggregate.REDUCTIONS[name][1]
+        if numeric_only or numeric_only is None and numeric:
+            cols = self._obj._cols()
+            locs = [i for i in locs if aggregate.is_numeric(cols[i])]
+        specs = [(i, name, kwargs) for i in locs]
+        return self._wrap(self._aggregate(specs, self._obj._columns[locs]))
+
+    def _wrap(self, df):
+        return df
+
+    def size(self):
+        df = self._aggregate([(None, "size", {})], [None])
+        return df._seq_at(0)
+
+    def sum(self, numeric_only=None, min_count=0):
+        return self._reduce("sum", numeric_only, min_count=min_count)
+
+    def mean(self, numeric_only=None):
+        return self._reduce("mean", numeric_only)
+
+    def min(self, numeric_only=False):
+        return self._reduce("min", numeric_only)
+
+    def max(self, numeric_only=False):
+        return self._reduce("max", numeric_only)
+
+    def count(self):
+        return self._reduce("count", False)
+
+    def var(self, ddof=1):
+        return self._reduce("var", ddof=ddof)
+
+    def std(self, ddof=1):
+        return self._reduce("std", ddof=ddof)
+
+    def agg(self, func=None, *args, **kwargs):
+        if isinstance(func, str):
+            if func not in aggregate.REDUCTIONS and func != "size":
+                raise AttributeError(f"'{func}' is not a valid function "
+                                     f"for '{self.__class__.__name__}' "
+                                     f"object")
+            return getattr(self, func)()
+        if isinstance(func, dict):
+            return self._agg_dict(func)
+        if pd.api.types.is_list_like(func):
+            return self._agg_list(list(func))
+        raise NotImplementedError
+
+    def _spec(self, loc, func):
+        if not isinstance(func, str):
+            raise NotImplementedError
+        if func == "size":
+            return (None, func, {})
+        if func not in aggregate.REDUCTIONS:
+            raise AttributeError(f"'{func}' is not a valid function "
+                                 f"for '{self.__class__.__name__}' object")
+        return (loc, func, {})
+
+    def _agg_list(self, funcs):
+        specs = [self._spec(loc, f) for loc in self._locs for f in funcs]
+        columns = pd.MultiIndex.from_product([self._labels(), funcs])
+        return self._aggregate(specs, columns)
+
+    def _agg_dict(self, funcs):
+        specs, columns = [], []
+        nested = any(pd.api.types.is_list_like(f) for f in funcs.values())
+        for label, func in funcs.items():
+            if label not in self._labels():
+                raise KeyError(f"Column(s) ['{label}'] do not exist")
+            loc = self._obj._columns.get_loc(label)
+            func = func if pd.api.types.is_list_like(func) else [func]
+            for f in func:
+                specs.append(self._spec(loc, f))
+                columns.append((label, f) if nested else label)
+        if nested:
+            columns = pd.MultiIndex.from_tuples(columns)
+        return self._aggregate(specs, columns)
+
+    aggregate = agg
+
+
+class SeriesGroupBy(GroupBy):
+    def _reduce(self, name, numeric_only=None, **kwargs):
+        # A Series keeps its column whatever its type
+        return super()._reduce(name, False, **kwargs)
+
+    def _wrap(self, df):
+        return df._seq_at(0, name=self._obj._columns[self._locs[0]])
+
+    def _agg_list(self, funcs):
+        specs = [self._spec(self._locs[0], f) for f in funcs]
+        return self._aggregate(specs, funcs)
+
+    def _agg_dict(self, funcs):
+        raise NotImplementedError
+
+
+class DataFrameGroupBy(GroupBy):
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._labels():
+            return self.__getattribute__(name)
+        return self[name]
+
+    def __getitem__(self, key):
+        labels = self._labels()
+        if pd.api.types.is_list_like(key):
+            missing = [k for k in key if k not in labels]
+            if missing:
+                raise KeyError(f"Columns not found: {missing}")
+            locs = [self._obj._columns.get_loc(k) for k in key]
+            return self._select(locs)
+        if key not in labels:
+            raise KeyError(f"Column not found: {key}")
+        return self._select([self._obj._columns.get_loc(key)], SeriesGroupBy)
+
+
+__all__ = ["GroupBy", "SeriesGroupBy", "DataFrameGroupBy"]
@@ -1,3 +1,6 @@
+import pandas as pd
+
+
 class _iAtIndexer:
     name = "iat"
 
@@ -18,4 +21,32 @@ class _iAtIndexer:
         return self.obj.ndim
 
 
-__all__ = ["_iAtIndexer"]
+class _LocIndexer:
+    name = "loc"
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __getitem__(self, key):
+        cols = slice(None)
+        if isinstance(key, tuple) and self.obj.ndim == 2:
+            if len(key) != 2:
+                raise pd.core.indexing.IndexingError("Too many indexers")
+            key, cols = key
+        obj = self.obj
+        if not is_null_slice(key):
+            obj = obj._loc_rows(key)
+        if not is_null_slice(cols):
+            obj = obj[cols]
+        return obj
+
+    @property
+    def ndim(self):
+        return self.obj.ndim
+
+
+def is_null_slice(key):
+    return isinstance(key, slice) and key == slice(None)
+
+
+__all__ = ["_iAtIndexer", "_LocIndexer"]
@@ -0,0 +1,84 @@
+import concurrent.futures
+import sqlalchemy as sa
+from . import db
+from . import dialect
+from . import cache
+from . import columnar
+
+WORKERS = None
+STRATEGY = "range"
+STRATEGIES = ("range", "ntile")
+
+
+def configure_parallel(workers=None, strategy="range"):
+    """
+    Fetch frames as workers partitions at once, each on a connection of
+    its own, or one query at a time if workers is None.
+
+    With strategy "range", the rows of a table with a row key are split
+    into ranges of the key, each read through the key alone. With
+    strategy "ntile", every partition numbers all the rows of the frame
+    in key order and keeps its share: more work for the database, but
+    it splits any frame with a row key, windows over it included.
+
+    Frames backed by temporary tables are fetched on the connection
+    they were created on, as are frames without a row key, and every
+    frame while the cache is enabled, if the engine has only one
+    connection to offer, or if the database runs in this process.
+    """
+    global WORKERS, STRATEGY
+    if strategy not in STRATEGIES:
+        raise ValueError(f"strategy must be one of {STRATEGIES}, "
+                         f"got {strategy!r}")
+    if workers is not None and workers < 1:
+        raise ValueError("workers must be a positive integer or None")
+    WORKERS = workers
+    STRATEGY = strategy
+
+
+def engine():
+    """
+    Return the engine to open the connections of the workers from, or
+    None if it cannot open more than the one frames are bound to.
+    """
+    if WORKERS is None or WORKERS < 2 or cache.enabled():
+        return None
+    if not dialect.CURRENT["parallel_fetch"]():
+        return None
+    engine_ = db.metadata().bind.engine
+    single = (sa.pool.SingletonThreadPool, sa.pool.StaticPool)
+    if isinstance(engine_.pool, single):
+        return None
+    return engine_
+
+
+def fetch_partition(engine_, query, columns):
+    with engine_.connect() as con:
+        if engine_.dialect.supports_server_side_cursors:
+            # As cache.execute() does when streaming
+            query = query.execution_options(stream_results=True)
+        return columnar.fetch_columns(con.execute(query), columns)
+
+
+def fetch_columns(engine_, queries, columns):
+    """
+    Run queries, partitions of the rows of columns, concurrently on
+    connections of engine_. Return the arrays fetch_columns() returns
+    for their rows, in the order of queries.
+    """
+    with concurrent.futures.ThreadPoolExecutor(len(queries)) as pool:
+        parts = list(
+            pool.map(lambda q: fetch_partition(engine_, q, columns), queries))
+    arrays = []
+    for i, c in enumerate(columns):
+        builder = columnar.ColumnBuilder(columnar.numpy_type(c))
+        for part in parts:
+            builder.extend(part[i])
+        arrays.append(builder.finish())
+    return arrays
+
+
+__all__ = [
+    "WORKERS", "STRATEGY", "STRATEGIES", "configure_parallel", "engine",
+    "fetch_partition", "fetch_columns"
+]
@@ -0,0 +1,106 @@
+import os
+import time
+import pickle
+import sqlalchemy as sa
+from . import db
+
+TTL = None
+PATH = None
+# (schema, name) => time the table was reflected
+REFLECTED = {}
+
+
+def configure_reflection(ttl=None, path=None):
+    """
+    Reuse reflected tables for ttl seconds, or until they are invalidated
+    if ttl is None. If path is not None, also keep them in the file at
+    path, for later sessions on the same database to reuse.
+    """
+    global TTL, PATH
+    TTL = ttl
+    PATH = path
+
+
+def fresh(reflected_at):
+    return TTL is None or time.time() - reflected_at < TTL
+
+
+def database():
+    """ Return the URL of the database, without password. """
+    url = db.metadata().bind.engine.url
+    return url.render_as_string(hide_password=True)
+
+
+def load_file():
+    """
+    Return the tables kept in the file at PATH, as a dict
+    {(database, schema, name): (time reflected, Table)}.
+    """
+    try:
+        with open(PATH, "rb") as f:
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def save_file(entries):
+    # Never leave a half-written file behind
+    path = f"{PATH}.{os.getpid()}"
+    with open(path, "wb") as f:
+        pickle.dump(entries, f)
+    os.replace(path, PATH)
+
+
+def table(name, schema=None):
+    """
+    Return the Table name of schema, reflected from the database unless
+    it already was recently enough.
+    """
+    metadata = db.metadata()
+    key = (schema, name)
+    tbl = metadata.tables.get(f"{schema}.{name}" if schema else name)
+    if tbl is not None:
+        if key in REFLECTED and fresh(REFLECTED[key]):
+            return tbl
+        # Start over, columns may have been dropped since
+        metadata.remove(tbl)
+    if PATH is not None:
+        kept = load_file().get((database(), schema, name))
+        if kept is not None and fresh(kept[0]):
+            REFLECTED[key] = kept[0]
+            return kept[1].to_metadata(metadata)
+    tbl = sa.Table(name, metadata, schema=schema, autoload=True)
+    views = sa.inspect(metadata.bind).get_view_names(schema=schema)
+    tbl.info["view"] = name in views
+    REFLECTED[key] = time.time()
+    if PATH is not None:
+        entries = load_file()
+        entries[(database(), schema, name)] = (REFLECTED[key],
+                                               tbl.to_metadata(sa.MetaData()))
+        save_file(entries)
+    return tbl
+
+
+def invalidate_reflection(table=None, schema=None):
+    """
+    Forget the reflected table of schema, or every reflected table if
+    table is None, including those kept in the file.
+    """
+    if table is None:
+        REFLECTED.clear()
+    else:
+        REFLECTED.pop((schema, table), None)
+    if PATH is None:
+        return
+    entries = load_file()
+    url = database() if db.METADATA is not None else None
+    for url_, schema_, table_ in list(entries):
+        if table is None or (url_, schema_, table_) == (url, schema, table):
+            del entries[(url_, schema_, table_)]
+    save_file(entries)
+
+
+__all__ = [
+    "TTL", "PATH", "REFLECTED", "configure_reflection", "fresh", "database",
+    "load_file", "save_file", "table", "invalidate_reflection"
+]
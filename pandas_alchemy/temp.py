@@ -0,0 +1,248 @@
+import hashlib
+import weakref
+import itertools
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from . import db
+from . import columnar
+
+COUNTER = itertools.count()
+GENERATION = 0
+PENDING = []
+LOADED = {}
+
+
+class Untyped(sa.types.UserDefinedType):
+    """
+    Column type of values of mixed types, stored as they are where
+    columns can go without a type, as in SQLite.
+    """
+    cache_ok = True
+
+    def get_col_spec(self, **kwargs):
+        # Only databases that require a type get one: they could not
+        # hold the values in a single column otherwise
+        return "TEXT"
+
+
+@compiles(Untyped, "sqlite")
+def compile_untyped_sqlite(element, compiler, **kwargs):
+    # No type, hence no affinity: values keep their own type
+    return ""
+
+
+SQL_TYPES = {
+    "integer": sa.BigInteger,
+    "floating": sa.Float,
+    "mixed-integer-float": sa.Float,
+    "decimal": sa.Numeric,
+    "boolean": sa.Boolean,
+    "string": sa.Text,
+    "bytes": sa.LargeBinary,
+    "datetime64": sa.DateTime,
+    "datetime": sa.DateTime,
+    "date": sa.Date,
+    "time": sa.Time,
+    "timedelta64": sa.Interval,
+    "timedelta": sa.Interval,
+    "empty": sa.Float,
+    "mixed": Untyped,
+    "mixed-integer": Untyped
+}
+
+
+def _release(name, generation):
+    if generation == GENERATION:
+        PENDING.append(name)
+
+
+class Handle:
+    """
+    Keep the temporary table name alive. Frames backed by the table
+    hold its Handle, and the table is dropped once the Handle is
+    garbage collected.
+
+    The lifetime of the Table object itself cannot be used for this,
+    since sqlalchemy's compiled cache keeps references to it.
+    """
+    def __init__(self, name):
+        self.name = name
+        weakref.finalize(self, _release, name, GENERATION)
+
+
+def collect():
+    """ Drop temporary tables that are no longer referenced. """
+    bind = db.metadata().bind
+    while PENDING:
+        sa.Table(PENDING.pop(), sa.MetaData()).drop(bind)
+
+
+def reset():
+    """
+    Forget every temporary table. Called when the connection, and
+    thus all temporary tables, goes away.
+    """
+    global GENERATION
+    GENERATION += 1
+    PENDING.clear()
+    LOADED.clear()
+
+
+class CreateTableAs(sa.sql.expression.Executable,
+                    sa.sql.expression.ClauseElement):
+    """ CREATE [TEMPORARY] TABLE tbl AS query """
+    inherit_cache = False
+    _execution_options = \
+        sa.sql.expression.Executable._execution_options.union(
+            {"autocommit": True})
+
+    def __init__(self, tbl, query, temporary=True):
+        self.table = tbl
+        self.query = query
+        self.temporary = temporary
+
+
+@compiles(CreateTableAs)
+def compile_create_table_as(element, compiler, **kwargs):
+    name = compiler.preparer.format_table(element.table)
+    query = compiler.process(element.query, **kwargs)
+    temporary = "TEMPORARY " if element.temporary else ""
+    return f"CREATE {temporary}TABLE {name} AS {query}"
+
+
+def table(*columns, query=None):
+    """
+    Create a temporary table with columns. If query is not None, the
+    table is filled with its rows, and columns only describe them.
+    Return (Table, Handle).
+    """
+    collect()
+    bind = db.metadata().bind
+    name = f"pandas_alchemy_{next(COUNTER)}"
+    tbl = sa.Table(name, sa.MetaData(bind), *columns, prefixes=["TEMPORARY"])
+    if query is None:
+        tbl.create()
+    else:
+        bind.execute(CreateTableAs(tbl, query))
+    return tbl, Handle(name)
+
+
+def sql_type(values):
+    """ Return the sqlalchemy type able to store values. """
+    if pd.api.types.is_datetime64tz_dtype(values.dtype):
+        return sa.DateTime(timezone=True)
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    return SQL_TYPES.get(kind, sa.Text)()
+
+
+def python_values(values):
+    """
+    Return values, a pandas Index or Series, as a list of Python objects
+    with NULL, that is None, for NA. NaN is NA in pandas, but only SQLite
+    stores it as NULL by itself.
+    """
+    if not values.hasnans:
+        return values.tolist()
+    values = np.asarray(values, dtype=object)
+    values[pd.isna(values)] = None
+    return values.tolist()
+
+
+def insert(values):
+    """
+    Create a temporary table holding values, a list of equally long
+    pandas Index or Series. Return (Table, Handle).
+
+    The first column of the table is "pos", the primary key holding
+    the position of each row. It is followed by one column for each
+    entry in values.
+    """
+    columns = [sa.Column(f"c{i}", sql_type(v)) for i, v in enumerate(values)]
+    pos = sa.Column("pos",
+                    sa.BigInteger,
+                    primary_key=True,
+                    autoincrement=False)
+    tbl, handle = table(pos, *columns)
+    keys = [c.name for c in tbl.columns]
+    rows = zip(itertools.count(), *[python_values(v) for v in values])
+    while True:
+        batch = [
+            dict(zip(keys, r))
+            for r in itertools.islice(rows, columnar.BATCH_SIZE)
+        ]
+        if not batch:
+            break
+        tbl.bind.execute(tbl.insert(), batch)
+    return tbl, handle
+
+
+def persist(columns, index=0):
+    """
+    Store the rows of columns, the columns of a query, into a temporary
+    table laid out as by insert(). If index is positive, create an index
+    on the first index columns. Return (Table, Handle).
+    """
+    pos = sa.func.row_number().over().label("pos")
+    query = sa.select([pos] +
+                      [c.label(f"c{i}") for i, c in enumerate(columns)])
+    tbl, handle = table(*[sa.Column(c.name, c.type) for c in query.columns],
+                        query=query)
+    if index > 0:
+        sa.Index(f"{tbl.name}_index",
+                 *list(tbl.columns)[1:index + 1]).create(tbl.bind)
+    return tbl, handle
+
+
+def fingerprint(obj):
+    """
+    Return a digest of the index and values of obj, or None if obj
+    holds values pandas cannot hash.
+    """
+    try:
+        hashed = pd.util.hash_pandas_object(obj, index=True)
+    except TypeError:
+        return None
+    return hashlib.sha1(hashed.to_numpy().tobytes()).hexdigest()
+
+
+def load(obj):
+    """
+    Load obj, a pandas DataFrame or Series, into a temporary table.
+    Return (Table, Handle). See insert() for the layout of the table.
+
+    The table is reused if the same obj is loaded again and its data
+    did not change in the meantime.
+    """
+    key = id(obj)
+    digest = fingerprint(obj)
+    if key in LOADED and digest is not None:
+        loaded_digest, loaded = LOADED[key]
+        if loaded_digest == digest:
+            return loaded
+    index = obj.index
+    values = [index.get_level_values(i) for i in range(index.nlevels)]
+    if isinstance(obj, pd.DataFrame):
+        values += [obj.iloc[:, i] for i in range(obj.shape[1])]
+    else:
+        values.append(obj)
+    loaded = insert(values)
+    if digest is not None:
+        if key not in LOADED:
+            weakref.finalize(obj, LOADED.pop, key, None)
+        LOADED[key] = (digest, loaded)
+    return loaded
+
+
+def select(tbl):
+    """ Select every column of tbl but "pos", in the order of "pos". """
+    columns = list(tbl.columns)
+    return sa.select(columns[1:]).order_by(columns[0])
+
+
+__all__ = [
+    "COUNTER", "GENERATION", "PENDING", "LOADED", "SQL_TYPES", "Untyped",
+    "Handle", "collect", "reset", "CreateTableAs", "table", "sql_type",
+    "python_values", "insert", "persist", "fingerprint", "load", "select"
+]
@@ -0,0 +1,157 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import pandas_alchemy as pa
+from pandas_alchemy import columnar
+
+
+@pytest.fixture
+def db():
+    pa.init_db("sqlite://")
+    yield
+    pa.close_db()
+
+
+def test_inlined_operator_precedence(db):
+    pdf = pd.DataFrame({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+    df = pa.DataFrame.from_pandas(pdf)
+    result = ((df.a + 1) * 2 - df.b).to_pandas()
+    expected = (pdf.a + 1) * 2 - pdf.b
+    pd.testing.assert_series_equal(result, expected, check_names=False)
+    result = (((df.a + 1) * 2 - df.b) / 3).to_pandas()
+    expected = ((pdf.a + 1) * 2 - pdf.b) / 3
+    pd.testing.assert_series_equal(result, expected, check_names=False)
+
+
+def test_dates_round_trip(db):
+    pdf = pd.DataFrame({
+        "d": [datetime.date(2020, 1, 1),
+              datetime.date(2020, 1, 2)],
+        "t":
+        pd.to_datetime(["2020-01-01 10:00", "2020-01-02 11:00"])
+    })
+    result = pa.DataFrame.from_pandas(pdf).to_pandas()
+    pd.testing.assert_frame_equal(result, pdf)
+
+
+def test_mixed_values_round_trip(db):
+    pdf = pd.DataFrame({"m": [1, "x", 2.5], "i": [1, "y", 3]})
+    result = pa.DataFrame.from_pandas(pdf).to_pandas()
+    pd.testing.assert_frame_equal(result, pdf)
+
+
+def test_large_expressions_stay_aligned(db):
+    pdf = pd.DataFrame({"a": [1.0, 2.0, 3.0], "b": [3.0, 4.0, 5.0]})
+    df = pa.DataFrame.from_pandas(pdf)
+    result, expected = df.a, pdf.a
+    for _ in range(30):
+        result, expected = result / 2 + 1, expected / 2 + 1
+    assert result._aligned(df)
+    result, expected = result - df.b, expected - pdf.b
+    assert result._aligned(df)
+    pd.testing.assert_series_equal(result.to_pandas(),
+                                   expected,
+                                   check_names=False)
+
+
+def test_clip_keeps_nulls(db):
+    pdf = pd.DataFrame({"a": [1.0, None, 5.0], "b": [None, 2.0, 9.0]})
+    df = pa.DataFrame.from_pandas(pdf)
+    pd.testing.assert_frame_equal(df.clip(2, 6).to_pandas(), pdf.clip(2, 6))
+    pd.testing.assert_series_equal(
+        df.a.clip(upper=df.b).to_pandas(), pdf.a.clip(upper=pdf.b))
+
+
+def test_cache_hits_with_nan_parameters(db):
+    df = pa.DataFrame.from_pandas(pd.DataFrame({"a": [1.0, 2.0]}))
+    pa.enable_cache()
+    try:
+        hits = pa.cache_stats()["hits"]
+        for _ in range(3):
+            (df.a / 2).to_pandas()
+        stats = pa.cache_stats()
+    finally:
+        pa.disable_cache()
+    assert stats["hits"] - hits == 2
+    assert stats["entries"] == 1
+
+
+def test_duckdb_double_precision():
+    pytest.importorskip("duckdb_engine")
+    pa.init_db("duckdb:///:memory:")
+    try:
+        pdf = pd.DataFrame({"a": [1 / 3, 2.0], "b": [3, 7]})
+        df = pa.DataFrame.from_pandas(pdf)
+        pd.testing.assert_frame_equal(df.to_pandas(), pdf)
+        pd.testing.assert_series_equal((df.b / 7).to_pandas(), pdf.b / 7)
+        assert df.a.mean() == pdf.a.mean()
+    finally:
+        pa.close_db()
+
+
+def test_applymap_returns_a_copy(db):
+    pdf = pd.DataFrame({"a": [1, 2, 3]})
+    df = pa.DataFrame.from_pandas(pdf)
+    result = df.applymap(lambda c: c * 10)
+    pd.testing.assert_frame_equal(result.to_pandas(), pdf * 10)
+    pd.testing.assert_frame_equal(df.to_pandas(), pdf)
+
+
+def test_groupby_aggregations(db):
+    pdf = pd.DataFrame({
+        "k": ["x", "y", "x"],
+        "a": [1, 2, 3],
+        "b": [1.0, 2.0, 4.0]
+    })
+    df = pa.DataFrame.from_pandas(pdf)
+    pd.testing.assert_frame_equal(
+        df.groupby("k").sum().to_pandas(),
+        pdf.groupby("k").sum())
+    assert df.b.sum() == pdf.b.sum()
+
+
+def test_groupby_frame_not_implemented(db):
+    df = pa.DataFrame.from_pandas(pd.DataFrame({"a": [1, 2], "b": [3, 4]}))
+    with pytest.raises(NotImplementedError):
+        df.a.groupby(df.b)
+
+
+def test_empty_without_row_count(db):
+    pa.DataFrame.from_pandas(pd.DataFrame({"b": [1, 2]})).to_sql("t")
+    df = pa.DataFrame.from_table("t")
+    assert not df.empty
+    assert df[df.b > 100].empty
+    assert not df[df.b > 1].empty
+
+
+def test_var_with_large_mean(db):
+    pdf = pd.DataFrame({
+        "k": ["x", "x", "x"],
+        "a": [1e9 + 1, 1e9 + 2, 1e9 + 3]
+    })
+    df = pa.DataFrame.from_pandas(pdf)
+    assert df.a.var() == pdf.a.var()
+    assert df.a.std() == pdf.a.std()
+    pd.testing.assert_frame_equal(
+        df.groupby("k").var().to_pandas(),
+        pdf.groupby("k").var())
+
+
+def test_non_boolean_series_is_no_mask(db):
+    pdf = pd.DataFrame({"b": [0, 1, 2], "c": [True, False, True]})
+    df = pa.DataFrame.from_pandas(pdf)
+    pd.testing.assert_frame_equal(df[df.c].to_pandas(), pdf[pdf.c])
+    with pytest.raises(KeyError):
+        df[df.b]
+
+
+def test_nullable_floats_stay_typed(db):
+    builder = columnar.ColumnBuilder(np.float64)
+    builder.extend([1.0, None])
+    builder.extend([2.5])
+    # Preallocated as float64 throughout, not turned into objects
+    assert builder._data.dtype == np.float64
+    pdf = pd.DataFrame({"a": [1.0, None, 2.5]})
+    result = pa.DataFrame.from_pandas(pdf).to_pandas()
+    pd.testing.assert_frame_equal(result, pdf)